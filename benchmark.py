@@ -0,0 +1,304 @@
+"""Headless benchmark of the dashboard's reactive outputs.
+
+Runs app.server in an in-memory shiny session (no browser, no network) on a
+synthetic dataset shaped like OCED_simplified.csv, replays scripted
+interaction traces and reports per-output render latency percentiles, the
+latency of each interaction step, peak memory and payload bytes.
+
+    python benchmark.py --rows 10 --cols 1
+    python benchmark.py --rows 100 --cols 2 --repeat 3 --json bench.json
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+
+# no debounce delay: every step is measured up to its final render, and no
+# background refresh of the (swapped in) dataset
+os.environ.setdefault("DASHBOARD_DEBOUNCE_SECS", "0")
+os.environ.setdefault("DASHBOARD_REFRESH_SECS", "0")
+
+import numpy as np
+import pandas as pd
+from shiny import App
+from shiny.render.renderer import Renderer
+from shiny.testserver import test_server
+
+import app
+from catalog import variable_catalog
+from data_store import dataset_store
+from lazy_imports import profiled_import
+
+# the app imports the plotting stack in the background. Import it up front:
+# the plot is there from the first flush, and RenderTimer patches its renderer
+for module in app.PLOT_MODULES:
+    profiled_import(module)
+
+BASE_COUNTRIES = 40
+BASE_YEARS = 60
+FIRST_YEAR = 1960
+
+OUTPUTS = (
+    "Countries_from_data",
+    "slider_years_values_from_data",
+    "variables_filtered_dataset",
+    "plot_timeseries",
+    "table_all_data_with_year_from_slider",
+    "comparison_table",
+)
+
+
+#synthetic OECD-like table: one row per (country, year), one float column per
+#catalog variable, ~half of the values missing. rows and cols are multipliers
+#of the base shape (40 countries x 60 years, ~715 variables)
+def synthetic_dataset(rows=1, cols=1, seed=0):
+    rng = np.random.default_rng(seed)
+    n_countries = BASE_COUNTRIES * rows
+    countries = ["Country " + str(i).zfill(5) for i in range(n_countries)]
+    years = np.arange(FIRST_YEAR, FIRST_YEAR + BASE_YEARS)
+    variables = []
+    for copy in range(cols):
+        suffix = "" if copy == 0 else " #" + str(copy)
+        variables.extend(variable + suffix for variable in variable_catalog().variables)
+
+    n_rows = n_countries * len(years)
+    columns = {
+        "country": np.repeat(countries, len(years)),
+        "year": np.tile(years, n_countries),
+    }
+    for variable in variables:
+        values = rng.gamma(2.0, 10.0, n_rows).round(3)
+        values[rng.random(n_rows) < 0.5] = np.nan
+        columns[variable] = values
+    #the upstream file is not sorted by (country, year)
+    return pd.DataFrame(columns).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    values = np.array(samples) * 1000
+    return {
+        "n": len(samples),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+#timing of every output render, keyed by output id
+class RenderTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._patched = []
+
+    def __enter__(self):
+        classes = [Renderer]
+        while classes:
+            cls = classes.pop()
+            classes.extend(cls.__subclasses__())
+            if "render" in cls.__dict__:
+                self._patch(cls)
+        return self
+
+    def _patch(self, cls):
+        original = cls.__dict__["render"]
+        samples = self.samples
+
+        async def render(renderer):
+            start = time.perf_counter()
+            try:
+                return await original(renderer)
+            finally:
+                samples[renderer.output_id].append(time.perf_counter() - start)
+
+        cls.render = render
+        self._patched.append((cls, original))
+
+    def __exit__(self, *exc):
+        for cls, original in self._patched:
+            cls.render = original
+
+
+#bytes sent to the client per output. Widget (plotly) traffic goes through
+#custom messages and is counted under the widget's output
+class PayloadCounter:
+    def __init__(self, widget_output="plot_timeseries"):
+        self.widget_output = widget_output
+        self.bytes = defaultdict(int)
+        self.total = 0
+
+    def attach(self, session):
+        conn = session._conn
+        send = conn.send
+
+        async def counting_send(message):
+            self.count(message)
+            await send(message)
+
+        conn.send = counting_send
+
+    def count(self, message):
+        self.total += len(message)
+        try:
+            parsed = json.loads(message)
+        except ValueError:
+            return
+        for name, value in (parsed.get("values") or {}).items():
+            self.bytes[name] += len(json.dumps(value))
+        if "custom" in parsed:
+            self.bytes[self.widget_output] += len(json.dumps(parsed["custom"]))
+
+
+#scripted interactions: each step is (name, inputs to set)
+def interaction_traces(countries, years, variables, n_countries=5):
+    chosen = tuple(countries[:n_countries])
+    first_year, last_year = int(years.min()), int(years.max())
+    start = [
+        ("choose_dataset", dict(datasets_included=("Consultations",), variable_search="")),
+        ("choose_variable", dict(variable_to_plot=variables[0])),
+        ("choose_countries", dict(
+            selected_countries=chosen,
+            slider_years_2=last_year,
+            highlight=False,
+            table_sort="country",
+            table_page=1,
+            show_comparison=True,
+            comparison_metric="percentile",
+        )),
+    ]
+    traces = {
+        "add_countries": [
+            ("add_country", dict(selected_countries=tuple(countries[:k])))
+            for k in range(1, min(len(countries), 3 * n_countries) + 1)
+        ],
+        "slider_drag": [
+            ("slider", dict(slider_years_2=year))
+            for year in range(last_year, first_year - 1, -1)
+        ],
+        "toggle_highlight": [
+            ("highlight", dict(highlight=bool(i % 2)))
+            for i in range(1, 11)
+        ],
+        "sort_table": [
+            ("table_sort", dict(table_sort=order))
+            for order in ("desc", "asc", "country")
+        ],
+        "switch_metric": [
+            ("comparison_metric", dict(comparison_metric=metric))
+            for metric in ("rank", "zscore", "change", "value", "percentile")
+        ],
+        "switch_variable": [
+            ("variable", dict(variable_to_plot=variable))
+            for variable in variables[:10]
+        ],
+    }
+    return start, traces
+
+
+def run(rows=1, cols=1, repeat=1, seed=0):
+    df = synthetic_dataset(rows, cols, seed)
+    dataset_bytes = int(df.memory_usage(deep=True).sum())
+    dataset_shape = df.shape
+    countries = sorted(df["country"].unique())
+    years = df["year"].unique()
+    variables = variable_catalog().variables_in(["Consultations", "Immunisation", "Screening"])
+    start, traces = interaction_traces(countries, years, variables)
+
+    payload = PayloadCounter()
+
+    def bench_server(input, output, session):
+        payload.attach(session)
+        return app.server(input, output, session)
+
+    bench_app = App(app.app_ui, bench_server)
+    step_samples = defaultdict(list)
+
+    tracemalloc.start()
+    load_start = time.perf_counter()
+    dataset_store.swap(df)
+    load_time = time.perf_counter() - load_start
+    del df
+    with RenderTimer() as timer:
+        for _ in range(repeat):
+            session_start = time.perf_counter()
+            with test_server(bench_app, timeout_secs=600) as ts:
+                step_samples["session_start"].append(time.perf_counter() - session_start)
+                for name, inputs in start:
+                    step_start = time.perf_counter()
+                    ts.set_inputs(**inputs)
+                    step_samples[name].append(time.perf_counter() - step_start)
+                for trace in traces.values():
+                    for name, inputs in trace:
+                        step_start = time.perf_counter()
+                        ts.set_inputs(**inputs)
+                        step_samples[name].append(time.perf_counter() - step_start)
+                    ts.set_inputs(**dict(start[-1][1]))
+                errors = {
+                    name: value.error
+                    for name, value in ts.to_values().outputs.items()
+                    if value.status == "error"
+                }
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "rows_scale": rows,
+        "cols_scale": cols,
+        "dataset_rows": dataset_shape[0],
+        "dataset_columns": dataset_shape[1],
+        "dataset_bytes": dataset_bytes,
+        "snapshot_build_ms": round(load_time * 1000, 3),
+        "peak_memory_bytes": peak_bytes,
+        "outputs": {
+            name: percentiles(timer.samples.get(name, [])) for name in OUTPUTS
+        },
+        "steps": {name: percentiles(samples) for name, samples in step_samples.items()},
+        "payload_bytes": dict(payload.bytes),
+        "payload_bytes_total": payload.total,
+        "result_cache": dataset_store.results.stats(),
+        "errors": errors,
+    }
+
+
+def print_report(report):
+    print(
+        "dataset: {dataset_rows} rows x {dataset_columns} columns "
+        "({dataset_bytes} bytes), snapshot built in {snapshot_build_ms} ms".format(**report)
+    )
+    print("peak memory: {peak_memory_bytes} bytes".format(**report))
+    print("\noutput render latency")
+    for name, stats in report["outputs"].items():
+        print("  {:<40} {}".format(name, stats))
+    print("\ninteraction step latency")
+    for name, stats in report["steps"].items():
+        print("  {:<40} {}".format(name, stats))
+    print("\npayload bytes (total {})".format(report["payload_bytes_total"]))
+    for name, nbytes in sorted(report["payload_bytes"].items()):
+        print("  {:<40} {}".format(name, nbytes))
+    print("\nresult cache", report["result_cache"])
+    if report["errors"]:
+        print("\nerrors", report["errors"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1, help="multiplier of the number of countries")
+    parser.add_argument("--cols", type=int, default=1, help="multiplier of the number of variables")
+    parser.add_argument("--repeat", type=int, default=1, help="sessions to replay the traces in")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args.rows, args.cols, args.repeat, args.seed)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
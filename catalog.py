@@ -0,0 +1,86 @@
+import bisect
+import os
+import re
+
+import pandas as pd
+
+COLUMNS_CSV_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "columns_dataset.csv"
+)
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+#variables of the OECD table grouped by health dataset, built once from
+#data/columns_dataset.csv, with an inverted token index for search
+class VariableCatalog:
+    def __init__(self, columns_df):
+        columns_df = columns_df.dropna(subset=["column", "health_dataset"])
+        self.variables = list(columns_df["column"])
+        self.groups = list(dict.fromkeys(columns_df["health_dataset"]))
+        self._by_group = {group: [] for group in self.groups}
+        for variable, group in zip(columns_df["column"], columns_df["health_dataset"]):
+            self._by_group[group].append(variable)
+
+        #token -> ids of the variables containing it. Tokens are kept sorted
+        #so a search token matches every indexed token it is a prefix of
+        self._postings = {}
+        for variable_id, variable in enumerate(self.variables):
+            for token in set(tokenize(variable)):
+                self._postings.setdefault(token, set()).add(variable_id)
+        self._tokens = sorted(self._postings)
+
+    @classmethod
+    def from_csv(cls, path=COLUMNS_CSV_PATH):
+        return cls(pd.read_csv(path))
+
+    def variables_in(self, groups):
+        variables = []
+        for group in groups or ():
+            variables.extend(self._by_group.get(group, ()))
+        return variables
+
+    def _ids_with_prefix(self, prefix):
+        ids = set()
+        position = bisect.bisect_left(self._tokens, prefix)
+        while position < len(self._tokens) and self._tokens[position].startswith(prefix):
+            ids |= self._postings[self._tokens[position]]
+            position += 1
+        return ids
+
+    #variables matching every word of the query (as word prefixes), in catalog
+    #order, optionally restricted to some groups and capped at limit results
+    def search(self, query, groups=None, limit=None):
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            candidates = self.variables_in(groups) if groups else list(self.variables)
+            return candidates[:limit] if limit else candidates
+        ids = None
+        for token in query_tokens:
+            token_ids = self._ids_with_prefix(token)
+            ids = token_ids if ids is None else ids & token_ids
+            if not ids:
+                return []
+        allowed = set(self.variables_in(groups)) if groups else None
+        results = []
+        for variable_id in sorted(ids):
+            variable = self.variables[variable_id]
+            if allowed is None or variable in allowed:
+                results.append(variable)
+                if limit and len(results) >= limit:
+                    break
+        return results
+
+
+_catalog = None
+
+
+def variable_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = VariableCatalog.from_csv()
+    return _catalog
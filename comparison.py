@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+#metrics of ComparisonEngine.metric(), all (variable, country, year) arrays:
+#the value itself, its rank and percentile among the countries of that year,
+#its z-score across those countries, and the change on the previous year
+METRICS = ("value", "rank", "percentile", "zscore", "change")
+
+
+#variables of a snapshot as one dense float32 (variable, country, year) array,
+#filled in a single pass over the wide table. metrics are computed for all
+#those variables up front, others on first use, and kept, so "where does this
+#country stand" queries are lookups instead of a filter and groupby per
+#variable. The store builds one per (variables, metric) and counts its nbytes
+#against the results budget (see DatasetStore.comparison())
+class ComparisonEngine:
+    def __init__(self, index, variables=None, metrics=(), batch_columns=64):
+        if variables is None:
+            variables = index.variables
+        self.variables = list(variables)
+        self.countries = list(index.df["country"].cat.categories)
+        self.years = np.unique(index.years)
+        self._variable_positions = {name: i for i, name in enumerate(self.variables)}
+        self._country_positions = {name: i for i, name in enumerate(self.countries)}
+
+        codes = index.df["country"].cat.codes.to_numpy()
+        year_positions = np.searchsorted(self.years, index.years)
+        self.values = np.full((len(self.variables), len(self.countries), len(self.years)), np.nan, dtype=np.float32)
+        #read the source a batch of columns at a time, rows in (country, year) order
+        for start in range(0, len(self.variables), batch_columns):
+            names = self.variables[start:start + batch_columns]
+            columns = index.numeric_columns(names)
+            block = np.vstack([columns[name] for name in names])
+            self.values[start:start + len(names), codes, year_positions] = block
+        #countries with a value, per (variable, year)
+        self.counts = (~np.isnan(self.values)).sum(axis=1, dtype=np.int32)
+        self._metrics = {"value": self.values}
+        for name in metrics:
+            self.metric(name)
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes + sum(values.nbytes for values in self._metrics.values())
+
+    def metric(self, name):
+        values = self._metrics.get(name)
+        if values is None:
+            if name not in METRICS:
+                raise ValueError("unknown metric: " + str(name))
+            values = getattr(self, "_compute_" + name)()
+            self._metrics[name] = values
+        return values
+
+    #1 for the highest value of a (variable, year); ties share the best rank,
+    #missing values have none
+    def _compute_rank(self):
+        values = self.values
+        order = np.argsort(-values, axis=1, kind="stable")
+        ranked = np.take_along_axis(values, order, axis=1)
+        positions = np.arange(1, values.shape[1] + 1, dtype=np.float32).reshape(1, -1, 1)
+        tie_start = np.ones(ranked.shape, dtype=bool)
+        tie_start[:, 1:] = ranked[:, 1:] != ranked[:, :-1]
+        sorted_ranks = np.maximum.accumulate(np.where(tie_start, positions, np.float32(0)), axis=1)
+        ranks = np.empty(values.shape, dtype=np.float32)
+        np.put_along_axis(ranks, order, sorted_ranks, axis=1)
+        ranks[np.isnan(values)] = np.nan
+        return ranks
+
+    #share of the other countries of that year with a value at or below, 0-100
+    def _compute_percentile(self):
+        ranks = self.metric("rank")
+        counts = self.counts[:, None, :].astype(np.float32)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            percentiles = 100 * (counts - ranks) / (counts - 1)
+        percentiles = np.where(counts > 1, percentiles, np.float32(100))
+        percentiles[np.isnan(ranks)] = np.nan
+        return percentiles
+
+    #standard score across the countries of that year (population std),
+    #accumulated in float64
+    def _compute_zscore(self):
+        values = self.values.astype(np.float64)
+        valid = ~np.isnan(values)
+        counts = self.counts[:, None, :]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(valid, values, 0.0).sum(axis=1, keepdims=True) / counts
+            deviations = np.where(valid, values - means, 0.0)
+            stds = np.sqrt((deviations ** 2).sum(axis=1, keepdims=True) / counts)
+            zscores = (values - means) / stds
+        zscores[~np.isfinite(zscores)] = np.nan
+        return zscores.astype(np.float32)
+
+    #difference with the previous year in the data, for the same country
+    def _compute_change(self):
+        change = np.full(self.values.shape, np.nan, dtype=np.float32)
+        change[:, :, 1:] = self.values[:, :, 1:] - self.values[:, :, :-1]
+        return change
+
+    #position of the latest year <= year, or None before the first year
+    def year_position(self, year):
+        position = int(np.searchsorted(self.years, year, side="right")) - 1
+        if position < 0:
+            return None
+        return position
+
+    def _positions(self, names, positions):
+        kept = [name for name in names if name in positions]
+        return kept, np.array([positions[name] for name in kept], dtype=np.intp)
+
+    #every country with a value of the variable in the year, best first
+    def ranking(self, variable, year):
+        columns = ["country"] + list(METRICS)
+        year_position = self.year_position(year)
+        if year_position is None or variable not in self._variable_positions:
+            return pd.DataFrame(columns=columns)
+        position = self._variable_positions[variable]
+        ranking_df = pd.DataFrame({"country": self.countries})
+        for metric in METRICS:
+            ranking_df[metric] = self.metric(metric)[position, :, year_position]
+        ranking_df = ranking_df.dropna(subset=["value"])
+        return ranking_df.sort_values(["rank", "country"]).reset_index(drop=True)[columns]
+
+    #one row per variable for a country in the year, with the number of
+    #countries it is compared with
+    def profile(self, country, year, variables=None):
+        columns = ["variable"] + list(METRICS) + ["countries"]
+        year_position = self.year_position(year)
+        if year_position is None or country not in self._country_positions:
+            return pd.DataFrame(columns=columns)
+        names, positions = self._positions(
+            self.variables if variables is None else variables,
+            self._variable_positions
+        )
+        country_position = self._country_positions[country]
+        profile_df = pd.DataFrame({"variable": names})
+        for metric in METRICS:
+            profile_df[metric] = self.metric(metric)[positions, country_position, year_position]
+        profile_df["countries"] = self.counts[positions, year_position]
+        return profile_df[columns]
+
+    #one metric for several countries side by side: variables x countries
+    def compare(self, countries, year, metric="percentile", variables=None):
+        names, variable_positions = self._positions(
+            self.variables if variables is None else variables,
+            self._variable_positions
+        )
+        countries, country_positions = self._positions(countries, self._country_positions)
+        year_position = self.year_position(year)
+        if year_position is None:
+            data = np.full((len(names), len(countries)), np.nan)
+        else:
+            data = self.metric(metric)[np.ix_(variable_positions, country_positions, [year_position])][:, :, 0]
+        return pd.DataFrame(data, index=pd.Index(names, name="variable"), columns=countries)
@@ -0,0 +1,418 @@
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyodide.http
+except ImportError:
+    # running outside shinylive (local shiny, scripts). Fall back to urllib
+    pyodide = None
+
+DATA_URL = "https://raw.githubusercontent.com/drpawelo/data/main/health/OCED_simplified.csv"
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# local copy shipped with the app, used when the upstream file cannot be reached
+BUNDLED_CSV_PATH = os.path.join(DATA_DIR, "OCED_simplified.csv")
+# binary columnar cache of the parsed dataset plus the validators of its source
+CACHE_META_PATH = os.path.join(DATA_DIR, "OCED_simplified.cache.json")
+# bytes read from the network at a time, and parsed as soon as they arrive
+CHUNK_SIZE = 256 * 1024
+# prefix of cache files being written, renamed into place once complete
+TEMP_PREFIX = ".OCED_simplified.tmp"
+# cached versions other than the current and the previous one are removed
+# once they are this old
+STALE_CACHE_SECS = 24 * 3600
+
+# pyarrow is imported by name so shinylive's scan of the app's imports does not
+# ship it to the browser, where the npy cache is enough
+pyarrow_parquet = None
+if pyodide is None:
+    try:
+        pyarrow_parquet = importlib.import_module("pyarrow.parquet")
+    except ImportError:
+        pass
+# one .npy file per column: still columnar and readable one column at a time,
+# with nothing beyond numpy
+CACHE_FORMAT = "npy" if pyarrow_parquet is None else "parquet"
+
+
+
+#cache of one version of the file. Versions get their own path so a snapshot
+#still reading the previous cache is not affected by a refresh writing a new one
+def cache_path(sha256):
+    return os.path.join(DATA_DIR, "OCED_simplified." + sha256[:16] + "." + CACHE_FORMAT)
+
+
+#column sources. read(names) returns those columns, rows in file order, so the
+#dataset store can load country and year first and other columns on demand.
+#fingerprint is the content hash of the file they hold, when it is known
+class FrameSource:
+    def __init__(self, df, fingerprint=None):
+        self.df = df
+        self.columns = list(df.columns)
+        self.fingerprint = fingerprint
+
+    def read(self, names):
+        return self.df[list(names)]
+
+
+class ParquetSource:
+    def __init__(self, path, fingerprint=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.columns = list(pyarrow_parquet.read_schema(path).names)
+
+    def read(self, names):
+        return pd.read_parquet(self.path, columns=list(names))
+
+
+class NpySource:
+    def __init__(self, path, fingerprint=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        with open(os.path.join(path, "columns.json")) as f:
+            self.columns = json.load(f)
+        self._files = {name: str(i) + ".npy" for i, name in enumerate(self.columns)}
+
+    def read(self, names):
+        return pd.DataFrame({
+            name: np.load(os.path.join(self.path, self._files[name]), allow_pickle=False)
+            for name in names
+        })
+
+
+#fetch a file as it arrives. Returns (status, headers, chunks): chunks is an
+#async iterator of bytes, empty on 304
+async def fetch_chunks(url, headers=None, chunk_size=CHUNK_SIZE):
+    headers = headers or {}
+    if pyodide is not None:
+        response = await pyodide.http.pyfetch(url, headers=headers)
+        return response.status, dict(response.headers), _pyodide_chunks(response)
+    status, response_headers, response = await asyncio.to_thread(_open_urllib, url, headers)
+    return status, response_headers, _urllib_chunks(response, chunk_size)
+
+
+async def _pyodide_chunks(response):
+    if response.status == 304:
+        return
+    reader = response.js_response.body.getReader()
+    while True:
+        result = await reader.read()
+        if result.done:
+            break
+        yield result.value.to_bytes()
+
+
+async def _urllib_chunks(response, chunk_size):
+    if response is None:
+        return
+    try:
+        while True:
+            data = await asyncio.to_thread(response.read, chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        response.close()
+
+
+#run a blocking call (parsing, cache writes, diffs) off the event loop, so
+#sessions keep being served. pyodide has no threads: it runs in place there
+async def run_blocking(fn, *args):
+    if pyodide is not None:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+def _open_urllib(url, headers):
+    import urllib.error
+    import urllib.request
+
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        response = urllib.request.urlopen(request, timeout=30)
+    except urllib.error.HTTPError as error:
+        if error.code == 304:
+            return 304, dict(error.headers), None
+        raise
+    return response.status, dict(response.headers), response
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def parse_csv(text):
+    return pd.read_csv(StringIO(text))
+
+
+#CSV followed while it downloads: feed() it the bytes as they arrive and the
+#country and year columns of every block of complete lines are read right
+#away, so the columns, the countries and the range of years seen so far are
+#known before the last byte is in. The body itself is only spooled to a
+#temporary file; finish() parses it in one go. Assumes no quoted field spans
+#several lines (true of the OECD file)
+class StreamingCsvParser:
+    PROGRESS_COLUMNS = ("country", "year")
+
+    def __init__(self):
+        self.columns = None
+        self.countries = {}
+        self.min_year = None
+        self.max_year = None
+        self.rows = 0
+        self.nbytes = 0
+        self._hash = hashlib.sha256()
+        self._header = None
+        self._pending = b""
+        self._body = tempfile.TemporaryFile()
+
+    #content hash of everything fed so far, as content_hash() of the text
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def feed(self, data):
+        self._hash.update(data)
+        self._body.write(data)
+        self.nbytes += len(data)
+        data = self._pending + data
+        end = data.rfind(b"\n")
+        if end < 0:
+            self._pending = data
+            return
+        self._pending = data[end + 1:]
+        self._parse(data[:end + 1])
+
+    def _parse(self, block):
+        if self._header is None:
+            end = block.find(b"\n")
+            self._header, block = block[:end + 1], block[end + 1:]
+            self.columns = list(pd.read_csv(BytesIO(self._header), nrows=0).columns)
+        if not block.strip():
+            return
+        chunk_df = pd.read_csv(
+            BytesIO(self._header + block),
+            usecols=lambda name: name in self.PROGRESS_COLUMNS
+        )
+        self.rows += len(chunk_df)
+        if "country" in chunk_df:
+            self.countries.update(dict.fromkeys(chunk_df["country"].dropna().unique()))
+        if "year" in chunk_df and chunk_df["year"].notna().any():
+            min_year, max_year = chunk_df["year"].min(), chunk_df["year"].max()
+            self.min_year = min_year if self.min_year is None else min(self.min_year, min_year)
+            self.max_year = max_year if self.max_year is None else max(self.max_year, max_year)
+
+    #the whole table, once the last chunk was fed. The spooled body is removed
+    def finish(self):
+        if self._pending.strip():
+            self._parse(self._pending + b"\n")
+        self._pending = b""
+        with self._body as body:
+            if not body.tell():
+                return pd.DataFrame(columns=self.columns or [])
+            body.seek(0)
+            return pd.read_csv(body)
+
+    #drop the spooled body without parsing it
+    def close(self):
+        self._body.close()
+
+
+#cache: the parsed columns and their metadata (etag, sha256)
+def read_cache_meta():
+    try:
+        with open(CACHE_META_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_cache(meta=None):
+    if meta is None:
+        meta = read_cache_meta()
+    sha256 = meta.get("sha256")
+    if not sha256 or meta.get("format") != CACHE_FORMAT:
+        return None
+    path = cache_path(sha256)
+    if not os.path.exists(path):
+        return None
+    try:
+        return open_columns(path, sha256)
+    except Exception as error:
+        print("could not read dataset cache:", error)
+        return None
+
+
+#the columns of a frame in CACHE_FORMAT at path: a parquet file, or a
+#directory of one .npy file per column. open_columns() reads them back
+def write_columns(df, path):
+    if CACHE_FORMAT == "parquet":
+        df.to_parquet(path, index=False)
+        return
+    os.makedirs(path)
+    for i, name in enumerate(df.columns):
+        values = df[name].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        np.save(os.path.join(path, str(i) + ".npy"), values, allow_pickle=False)
+    with open(os.path.join(path, "columns.json"), "w") as f:
+        json.dump(list(df.columns), f)
+
+
+def open_columns(path, fingerprint=None):
+    if CACHE_FORMAT == "parquet":
+        return ParquetSource(path, fingerprint)
+    return NpySource(path, fingerprint)
+
+
+def write_cache(df, etag, sha256):
+    path = cache_path(sha256)
+    previous_sha256 = read_cache_meta().get("sha256")
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        # written under a temporary name and renamed into place, so other
+        # workers never read a partial cache
+        temp_dir = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=DATA_DIR)
+        try:
+            temp_path = os.path.join(temp_dir, os.path.basename(path))
+            write_columns(df, temp_path)
+            try:
+                os.replace(temp_path, path)
+            except OSError:
+                # a directory cannot replace another one: a concurrent worker
+                # already wrote this version (same content), keep theirs
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    except OSError as error:
+        # read-only deployments still work, they just parse every time
+        print("could not write dataset cache:", error)
+        return False
+    write_cache_meta(etag, sha256)
+    prune_caches({path} | ({cache_path(previous_sha256)} if previous_sha256 else set()))
+    return True
+
+
+#remove cached versions other than the current and the previous one (which a
+#running snapshot may still read columns from), and temporary files of
+#interrupted writes. Only once they are stale: another worker may still be on
+#an older version
+def prune_caches(keep, stale_secs=STALE_CACHE_SECS):
+    prefix = "OCED_simplified."
+    suffix = "." + CACHE_FORMAT
+    now = time.time()
+    for name in os.listdir(DATA_DIR):
+        path = os.path.join(DATA_DIR, name)
+        is_cache = name.startswith(prefix) and name.endswith(suffix)
+        if not (is_cache or name.startswith(TEMP_PREFIX)) or path in keep:
+            continue
+        try:
+            if now - os.path.getmtime(path) < stale_secs:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            # renamed or removed by another worker meanwhile
+            continue
+        except OSError as error:
+            print("could not remove old dataset cache:", error)
+
+
+#replaced in one step, so readers see the old or the new metadata
+def write_cache_meta(etag, sha256):
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=DATA_DIR)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"etag": etag, "sha256": sha256, "format": CACHE_FORMAT}, f)
+            os.replace(temp_path, CACHE_META_PATH)
+        except OSError:
+            os.remove(temp_path)
+            raise
+    except OSError as error:
+        print("could not write dataset cache:", error)
+
+
+def load_bundled():
+    if os.path.exists(BUNDLED_CSV_PATH):
+        with open(BUNDLED_CSV_PATH, encoding="utf-8") as f:
+            text = f.read()
+        return FrameSource(parse_csv(text), content_hash(text))
+    return None
+
+
+#load the dataset as a column source. The cache is used when upstream reports
+#the same ETag or the body has the same content hash. The body is followed
+#while it downloads; progress(parser) is called after every chunk, so callers
+#can use the columns, countries and years seen so far. Parsing runs off the
+#event loop
+async def load_dataset(url=DATA_URL, progress=None):
+    meta = read_cache_meta()
+    cached_source = read_cache(meta)
+    headers = {}
+    if cached_source is not None and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+
+    parser = None
+    try:
+        status, response_headers, chunks = await fetch_chunks(url, headers)
+        if status == 200:
+            parser = StreamingCsvParser()
+            async for data in chunks:
+                await run_blocking(parser.feed, data)
+                if progress is not None:
+                    progress(parser)
+    except Exception as error:
+        print("could not fetch online data:", error)
+        status, response_headers, parser = None, {}, None
+
+    if status == 304 and cached_source is not None:
+        print("dataset cache is up to date (etag)")
+        return cached_source
+
+    if parser is not None:
+        etag = {k.lower(): v for k, v in response_headers.items()}.get("etag")
+        sha256 = parser.sha256
+        # compared before parsing: an unchanged body is never parsed
+        if cached_source is not None and meta.get("sha256") == sha256:
+            print("dataset cache is up to date (content hash)")
+            parser.close()
+            if etag != meta.get("etag"):
+                write_cache_meta(etag, sha256)
+            return cached_source
+        try:
+            loaded_df = await run_blocking(parser.finish)
+        except Exception as error:
+            print("could not parse online data:", error)
+        else:
+            print("rebuilding dataset cache")
+            if await run_blocking(write_cache, loaded_df, etag, sha256):
+                # serve columns from the cache so the parsed frame can be freed
+                source = read_cache()
+                if source is not None:
+                    return source
+            return FrameSource(loaded_df, sha256)
+
+    #offline or upstream error: last good cache, then the bundled copy
+    if cached_source is not None:
+        print("using dataset cache (upstream unavailable)")
+        return cached_source
+    bundled_source = load_bundled()
+    if bundled_source is not None:
+        print("using bundled dataset (upstream unavailable)")
+        return bundled_source
+    raise RuntimeError("dataset could not be loaded from " + url)
@@ -0,0 +1,652 @@
+import asyncio
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from comparison import ComparisonEngine
+from data_loader import FrameSource, load_dataset, run_blocking
+
+# sessions share one frame; copy-on-write makes any accidental write by a
+# session copy the touched column instead of mutating the shared snapshot.
+# pandas 3 always does (and deprecates the option)
+if int(pd.__version__.split(".")[0]) < 3:
+    try:
+        pd.set_option("mode.copy_on_write", True)
+    except (KeyError, ValueError):
+        pass
+
+# diffs kept by the store, to move sessions a few versions forward at once
+MAX_DIFFS = 16
+
+
+#shrink a column to the smallest dtype that holds it: small ints, and float32
+#only when every value's shortest float32 repr parses back to the same
+#float64. That holds for decimal data with up to ~7 significant digits (0.1,
+#123456.7), while an exact float32 -> float64 round trip would not: 0.1 is not
+#a float32. Large or precise values keep float64. widen_values() undoes it
+def compact_values(values):
+    values = np.asarray(values)
+    if values.dtype.kind == "f" and values.dtype.itemsize > 4:
+        compact = values.astype(np.float32)
+        if np.array_equal(compact.astype(str).astype(values.dtype), values, equal_nan=True):
+            return compact
+        return values
+    if values.dtype.kind in "iu":
+        return pd.to_numeric(pd.Series(values), downcast="integer").to_numpy()
+    return values
+
+
+#arrays shared by every session are frozen: a write raises instead of
+#changing what the other sessions see
+def read_only(values):
+    values.setflags(write=False)
+    return values
+
+
+#float64 values of a column compact_values() stored as float32, exactly as
+#they were read: through the shortest repr, so 123456.7 does not come back as
+#123456.703125
+def widen_values(values):
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        return values.astype(str).astype(np.float64)
+    return values
+
+
+#rough size of a cached value, for the byte budget of BoundedCache
+def estimate_nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(item) for item in value)
+    return getattr(value, "nbytes", 64)
+
+
+#most recently used entries, bounded by entry count and total bytes, with
+#hit, miss and eviction counters to size it
+class BoundedCache:
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, nbytes)
+        self.bytes += nbytes
+        #the newest entry always stays, even if it alone is over the budget
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            self.bytes -= self._entries.popitem(last=False)[1][1]
+            self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    #(key, value, nbytes), least recently used first
+    def items(self):
+        return [(key, value, nbytes) for key, (value, nbytes) in list(self._entries.items())]
+
+    #replace every key by rekey(key), dropping the entries it returns None for
+    def rekey(self, rekey):
+        entries = self._entries
+        self._entries = OrderedDict()
+        self.bytes = 0
+        for key, (value, nbytes) in entries.items():
+            new_key = rekey(key)
+            if new_key is not None:
+                self._entries[new_key] = (value, nbytes)
+                self.bytes += nbytes
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+#rows sorted by (country, year) once, with the contiguous row range of every
+#country. Selecting k countries up to a year is k binary searches and slices
+#instead of a mask over the whole frame plus a sort.
+#only country and year are materialised up front; variable columns are read
+#from the source on first use into a bounded cache, already in sorted order
+class CountryYearIndex:
+    def __init__(self, source, max_columns=64, max_bytes=64 * 2**20):
+        if isinstance(source, pd.DataFrame):
+            source = FrameSource(source)
+        self.source = source
+        base_df = source.read(["country", "year"])
+        base_df = pd.DataFrame({
+            "country": base_df["country"].astype("category"),
+            "year": compact_values(base_df["year"].to_numpy()),
+        })
+        self.order = read_only(np.lexsort((
+            base_df["year"].to_numpy(),
+            base_df["country"].cat.codes.to_numpy(),
+        )))
+        self.df = base_df.iloc[self.order].reset_index(drop=True)
+        self.years = read_only(self.df["year"].to_numpy())
+        codes = self.df["country"].cat.codes.to_numpy()
+        self._countries = read_only(self.df["country"].to_numpy(dtype=object))
+        if len(codes):
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        else:
+            starts = np.empty(0, dtype=np.intp)
+        stops = np.r_[starts[1:], len(codes)].astype(np.intp)
+        self.slices = {
+            self._countries[start]: (int(start), int(stop))
+            for start, stop in zip(starts, stops)
+        }
+        self._columns = BoundedCache(max_columns, max_bytes)
+        #cumulative statistics, built on first use of each variable
+        self._cumulative = BoundedCache(max_columns, max_bytes)
+
+    @property
+    def variables(self):
+        return [name for name in self.source.columns if name not in ("country", "year")]
+
+    #one column in (country, year) order
+    def column(self, name):
+        if name == "country":
+            return self._countries
+        if name == "year":
+            return self.years
+        values = self._columns.get(name)
+        if values is None:
+            values = read_only(compact_values(self.source.read([name])[name].to_numpy())[self.order])
+            self._columns.put(name, values, values.nbytes)
+        return values
+
+    #numeric columns in (country, year) order, read straight from the source
+    #(not through the column cache), non-numbers as NaN
+    def numeric_columns(self, names):
+        source_df = self.source.read(names)
+        return {
+            name: pd.to_numeric(source_df[name], errors="coerce").to_numpy(dtype=float)[self.order]
+            for name in names
+        }
+
+    #take over the cached columns and statistics of these variables from the
+    #index of a previous version with the same rows
+    def adopt(self, other, variables):
+        for cache, other_cache in ((self._columns, other._columns), (self._cumulative, other._cumulative)):
+            for name, value, nbytes in other_cache.items():
+                if name in variables:
+                    cache.put(name, value, nbytes)
+
+    @property
+    def countries(self):
+        return sorted(self.slices)
+
+    #positional rows of the selected countries, in selection order, sorted by year
+    def rows(self, countries, max_year=None):
+        parts = []
+        for country in countries:
+            bounds = self.slices.get(country)
+            if bounds is None:
+                continue
+            start, stop = bounds
+            if max_year is not None:
+                stop = start + int(np.searchsorted(self.years[start:stop], max_year, side="right"))
+            parts.append(np.arange(start, stop))
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(parts)
+
+    def select(self, countries, max_year=None, columns=None):
+        if columns is None:
+            columns = list(self.source.columns)
+        rows = self.rows(countries, max_year)
+        return pd.DataFrame({name: widen_values(self.column(name)[rows]) for name in columns})
+
+    #last row of a country with year <= max_year, or None if there is none
+    def last_row(self, country, max_year):
+        bounds = self.slices.get(country)
+        if bounds is None:
+            return None
+        start, stop = bounds
+        position = start + int(np.searchsorted(self.years[start:stop], max_year, side="right")) - 1
+        if position < start:
+            return None
+        return position
+
+    def cumulative(self, variable):
+        stats = self._cumulative.get(variable)
+        if stats is None:
+            stats = CumulativeStats(self, variable)
+            self._cumulative.put(variable, stats, stats.nbytes)
+        return stats
+
+    #per-country statistic of a variable over all years up to max_year. Same
+    #result as filtering and grouping by country, one lookup per country
+    def summary(self, variable, countries, max_year, stat="mean"):
+        stats = self.cumulative(variable)
+        summary_countries = []
+        summary_values = []
+        for country in sorted(set(countries)):
+            position = self.last_row(country, max_year)
+            if position is None:
+                continue
+            summary_countries.append(country)
+            summary_values.append(stats.value(stat, self.slices[country][0], position))
+        return pd.DataFrame(
+            {"country": summary_countries, variable: np.array(summary_values, dtype=float)}
+        )
+
+
+#prefix sums and counts of one variable over the (country, year) sorted rows,
+#plus running min, max and last observed value within each country. NaN aware
+class CumulativeStats:
+    def __init__(self, index, variable):
+        values = pd.to_numeric(pd.Series(widen_values(index.column(variable))), errors="coerce").to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        #sums restart at every country: a country's sum does not come out of
+        #the difference of two large running totals
+        self.sums = np.zeros(len(values))
+        self.counts = np.cumsum(valid)
+        self.mins = np.full(len(values), np.nan)
+        self.maxs = np.full(len(values), np.nan)
+        self.starts = np.zeros(len(values), dtype=bool)
+        for start, stop in index.slices.values():
+            self.sums[start:stop] = np.cumsum(np.where(valid[start:stop], values[start:stop], 0.0))
+            self.mins[start:stop] = np.fmin.accumulate(values[start:stop])
+            self.maxs[start:stop] = np.fmax.accumulate(values[start:stop])
+            self.starts[start] = True
+        last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(values)), -1))
+        self.last_positions = last_valid
+        self.values = values
+        for array in (self.sums, self.counts, self.mins, self.maxs, self.starts, last_valid, values):
+            read_only(array)
+        self.nbytes = sum(
+            array.nbytes
+            for array in (self.sums, self.counts, self.mins, self.maxs, self.starts, last_valid, values)
+        )
+
+    #statistic over the rows start..position (inclusive) of one country
+    def value(self, stat, start, position):
+        if stat in ("mean", "sum", "count"):
+            total = self.sums[position] - (0.0 if self.starts[start] else self.sums[start - 1])
+            count = self.counts[position] - (self.counts[start - 1] if start else 0)
+            if stat == "sum":
+                return total
+            if stat == "count":
+                return count
+            return total / count if count else np.nan
+        if stat == "min":
+            return self.mins[position]
+        if stat == "max":
+            return self.maxs[position]
+        if stat == "last":
+            last_position = self.last_positions[position]
+            return self.values[last_position] if last_position >= start else np.nan
+        raise ValueError("unknown statistic: " + str(stat))
+
+
+#what changed between two versions of the dataset, keyed on (country, year):
+#rows added or removed, and per variable the countries whose values changed
+#(None when the variable itself was added or removed)
+class SnapshotDiff:
+    def __init__(self, added_rows=0, removed_rows=0, changed_cells=0, row_countries=(), changed=None):
+        self.added_rows = added_rows
+        self.removed_rows = removed_rows
+        self.changed_cells = changed_cells
+        #countries with rows added or removed: all their variables changed
+        self.row_countries = set(row_countries)
+        self.changed = dict(changed or {})
+
+    def __str__(self):
+        return (
+            str(self.added_rows) + " rows added, " + str(self.removed_rows) + " removed, "
+            + str(self.changed_cells) + " values changed in " + str(len(self.changed)) + " variables"
+        )
+
+    @property
+    def same_rows(self):
+        return not self.added_rows and not self.removed_rows
+
+    @property
+    def empty(self):
+        return self.same_rows and not self.changed
+
+    @property
+    def variables(self):
+        return set(self.changed)
+
+    #whether results computed from these variables and countries (None: all
+    #of them) are different in the new version
+    def affects(self, variables=None, countries=None):
+        if countries is not None:
+            countries = set(countries)
+        if self.row_countries and (countries is None or countries & self.row_countries):
+            return True
+        for variable, changed_countries in self.changed.items():
+            if variables is not None and variable not in variables:
+                continue
+            if changed_countries is None or countries is None or countries & changed_countries:
+                return True
+        return False
+
+    #one diff for this one followed by other
+    def merge(self, other):
+        changed = dict(self.changed)
+        for variable, countries in other.changed.items():
+            previous = changed.get(variable, set())
+            changed[variable] = None if previous is None or countries is None else previous | countries
+        return SnapshotDiff(
+            self.added_rows + other.added_rows,
+            self.removed_rows + other.removed_rows,
+            self.changed_cells + other.changed_cells,
+            self.row_countries | other.row_countries,
+            changed
+        )
+
+
+#row level diff of two indexes. Rows are matched on (country, year) with one
+#vectorized intersection of the sorted keys, then every shared variable is
+#compared on the matched rows (NaN equal to NaN). None if (country, year) is
+#not unique, in which case everything is taken as changed
+def diff_indexes(old, new, batch_columns=64):
+    countries = pd.Index(sorted(set(old.slices) | set(new.slices)))
+    years = np.r_[old.years, new.years].astype(np.int64)
+    if not len(years):
+        return SnapshotDiff(changed={name: None for name in set(old.variables) ^ set(new.variables)})
+    first_year, span = years.min(), years.max() - years.min() + 1
+
+    def row_keys(index):
+        codes = countries.get_indexer(index.df["country"].astype(object)).astype(np.int64)
+        return codes * span + (index.years.astype(np.int64) - first_year)
+
+    old_keys, new_keys = row_keys(old), row_keys(new)
+    if len(np.unique(old_keys)) != len(old_keys) or len(np.unique(new_keys)) != len(new_keys):
+        return None
+    _, old_rows, new_rows = np.intersect1d(old_keys, new_keys, assume_unique=True, return_indices=True)
+    added = np.setdiff1d(np.arange(len(new_keys)), new_rows)
+    removed = np.setdiff1d(np.arange(len(old_keys)), old_rows)
+    row_countries = set(new._countries[added]) | set(old._countries[removed])
+
+    old_variables = set(old.variables)
+    changed = {name: None for name in old_variables ^ set(new.variables)}
+    changed_cells = 0
+    shared = [name for name in new.variables if name in old_variables]
+    for start in range(0, len(shared), batch_columns):
+        names = shared[start:start + batch_columns]
+        old_columns = old.numeric_columns(names)
+        new_columns = new.numeric_columns(names)
+        for name in names:
+            old_values = old_columns[name][old_rows]
+            new_values = new_columns[name][new_rows]
+            differs = (old_values != new_values) & ~(np.isnan(old_values) & np.isnan(new_values))
+            if differs.any():
+                changed_cells += int(differs.sum())
+                changed[name] = set(new._countries[new_rows[differs]])
+    return SnapshotDiff(len(added), len(removed), changed_cells, row_countries, changed)
+
+
+#one immutable version of the dataset, with its (country, year) index. df only
+#holds the country and year columns; variables are read through the index.
+#The version is set when the store publishes it
+class Snapshot:
+    def __init__(self, source, version=None):
+        self.index = CountryYearIndex(source)
+        self.df = self.index.df
+        self.version = version
+        self.fingerprint = getattr(self.index.source, "fingerprint", None)
+
+    #carry over what the previous version computed for variables that did
+    #not change. Only when the rows are the same, so positions line up
+    def adopt(self, previous, diff):
+        if not diff.same_rows:
+            return
+        self.index.adopt(previous.index, set(self.index.variables) - diff.variables)
+
+
+#what a load in flight has seen so far: columns, countries and range of years,
+#for the selectors to use before the snapshot exists. version changes with
+#every update
+class LoadProgress:
+    def __init__(self):
+        self.version = 0
+        self.columns = []
+        self.countries = []
+        self.min_year = None
+        self.max_year = None
+        self.rows = 0
+
+    #progress callback of load_dataset()
+    def update(self, parser):
+        if len(parser.countries) != len(self.countries):
+            self.countries = sorted(parser.countries)
+        self.columns = parser.columns or []
+        self.min_year = None if parser.min_year is None else int(parser.min_year)
+        self.max_year = None if parser.max_year is None else int(parser.max_year)
+        self.rows = parser.rows
+        self.version += 1
+
+
+#process-wide dataset store. The first caller starts the load, concurrent
+#callers await the same in-flight load, later callers get the loaded snapshot
+class DatasetStore:
+    def __init__(self, loader=load_dataset, max_results=256, max_result_bytes=32 * 2**20):
+        self._loader = loader
+        self._snapshot = None
+        self._version = 0
+        self._loading = None
+        #computed outputs shared by all sessions (summary frames, selections,
+        #table HTML), keyed (kind, version, ...). See cached()
+        self.results = BoundedCache(max_results, max_result_bytes)
+        #(variables, countries) each result was computed from
+        self._dependencies = {}
+        #diff that produced each of the last versions
+        self._diffs = OrderedDict()
+        self._refreshing = False
+        self._refresher = None
+        self.progress = LoadProgress()
+        #why the last load started with start_loading() failed, if it did
+        self.load_error = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def loading(self):
+        return self._loading is not None and not self._loading.done()
+
+    #start the load without waiting for it, for callers that follow progress
+    #and version instead of awaiting get()
+    def start_loading(self):
+        if self._snapshot is not None or self.loading:
+            return
+        self.load_error = None
+        asyncio.ensure_future(self.get()).add_done_callback(self._report_load_failure)
+
+    def _report_load_failure(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.load_error = task.exception()
+            print("could not load dataset:", self.load_error)
+
+    async def get(self):
+        if self._snapshot is not None:
+            return self._snapshot
+        loop = asyncio.get_running_loop()
+        if self._loading is None or self._loading.get_loop() is not loop:
+            self._loading = loop.create_task(self._load())
+        try:
+            return await asyncio.shield(self._loading)
+        finally:
+            if self._loading is not None and self._loading.done():
+                if self._loading.cancelled() or self._loading.exception() is not None:
+                    # let the next caller retry a failed load
+                    self._loading = None
+
+    async def _load(self):
+        self.progress = LoadProgress()
+        source = await self._loader(progress=self.progress.update)
+        if self._snapshot is None:
+            self.swap(source)
+        return self._snapshot
+
+    #shared result, computed once per version. key is (kind, version, ...);
+    #variables and countries (None: all of them) are what it is computed from,
+    #so that a refresh only drops the results whose inputs changed
+    def cached(self, key, compute, variables=None, countries=None):
+        value = self.results.get(key)
+        if value is None:
+            value = self.results.put(key, compute())
+            self._dependencies[key] = (variables, countries)
+            if len(self._dependencies) > 4 * self.results.max_entries:
+                self._dependencies = {
+                    key: dependencies for key, dependencies in self._dependencies.items()
+                    if key in self.results
+                }
+        return value
+
+    #rankings, percentiles, z-scores or changes of the variables across
+    #countries (see comparison.py): built for one metric, shared like other
+    #results and counted in their byte budget. Moved to a new version when a
+    #refresh did not change the variables
+    def comparison(self, snapshot, variables, metric):
+        variables = tuple(variables)
+        return self.cached(
+            ("comparison_engine", snapshot.version, variables, metric),
+            lambda: ComparisonEngine(snapshot.index, variables, [metric]),
+            variables=variables
+        )
+
+    #changes from version to the current version, or None if not all of them
+    #are known (the session then has to treat everything as changed)
+    def diff_since(self, version):
+        diff = SnapshotDiff()
+        for step_version in range(version + 1, self._version + 1):
+            step = self._diffs.get(step_version)
+            if step is None:
+                return None
+            diff = diff.merge(step)
+        return diff
+
+    #publish a new snapshot from a DataFrame or a column source. Readers keep
+    #whichever snapshot they already hold
+    def swap(self, source):
+        return self._publish(Snapshot(source))
+
+    #with a diff from the current snapshot, results it does not affect move to
+    #the new version; without one, all results are dropped
+    def _publish(self, snapshot, diff=None):
+        previous = self._snapshot
+        self._version += 1
+        snapshot.version = self._version
+        self._snapshot = snapshot
+        if previous is None or diff is None:
+            self.results.clear()
+            self._dependencies = {}
+            self._diffs.clear()
+            return snapshot
+
+        self._diffs[self._version] = diff
+        while len(self._diffs) > MAX_DIFFS:
+            self._diffs.popitem(last=False)
+        dependencies = {}
+
+        def rekey(key):
+            key_dependencies = self._dependencies.get(key)
+            if key_dependencies is None or key[1] != previous.version or diff.affects(*key_dependencies):
+                return None
+            new_key = (key[0], self._version) + key[2:]
+            dependencies[new_key] = key_dependencies
+            return new_key
+
+        self.results.rekey(rekey)
+        self._dependencies = dependencies
+        return snapshot
+
+    #new index, diff and carried over caches, built off the event loop
+    def _prepare(self, source, current):
+        snapshot = Snapshot(source)
+        diff = diff_indexes(current.index, snapshot.index)
+        if diff is not None:
+            snapshot.adopt(current, diff)
+        return snapshot, diff
+
+    #check the source for a new version and publish it with its row level
+    #diff. Returns the diff, or None when nothing was published
+    async def refresh(self):
+        if self._refreshing or self._snapshot is None:
+            return None
+        self._refreshing = True
+        try:
+            current = self._snapshot
+            source = await self._loader()
+            fingerprint = getattr(source, "fingerprint", None)
+            if fingerprint is not None and fingerprint == current.fingerprint:
+                return None
+            snapshot, diff = await run_blocking(self._prepare, source, current)
+            if self._snapshot is not current:
+                # swapped while the diff was computed: it no longer applies
+                diff = None
+            self._publish(snapshot, diff)
+            print("dataset refreshed:", diff if diff is not None else "full reload")
+            return diff
+        finally:
+            self._refreshing = False
+
+    #poll the source every interval_secs in the background, once per event
+    #loop. Sessions follow new versions on their own (see app.py)
+    def start_refresher(self, interval_secs):
+        loop = asyncio.get_running_loop()
+        if self._refresher is None or self._refresher.get_loop() is not loop or self._refresher.done():
+            self._refresher = loop.create_task(self._refresh_every(interval_secs))
+        return self._refresher
+
+    async def _refresh_every(self, interval_secs):
+        while True:
+            await asyncio.sleep(interval_secs)
+            try:
+                await self.refresh()
+            except Exception as error:
+                print("could not refresh dataset:", error)
+
+
+dataset_store = DatasetStore()
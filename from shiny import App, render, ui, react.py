@@ -1,11 +1,14 @@
+import asyncio
 from shiny import App, render, ui, reactive
 import pandas as pd
-from io import StringIO
-import pyodide.http
-import matplotlib
-import plotly.express as px
-from shinywidgets import render_widget  
-from shinywidgets import output_widget, render_widget  
+from data_loader import StreamingCsvParser, fetch_chunks, run_blocking
+from lazy_imports import DEFER_IMPORTS, import_error, prefetch, profiled_import, ready
+
+#the plotting stack, imported in the background while the data loads
+PLOT_MODULES = ("shinywidgets", "plotly.express")
+if not DEFER_IMPORTS:
+    for module in PLOT_MODULES:
+        profiled_import(module)
 
 app_ui = ui.page_fluid(
         ui.layout_sidebar(
@@ -25,7 +28,7 @@ app_ui = ui.page_fluid(
                 """
                 **(1) Temporal trends.**
                 """),            
-            output_widget("plot_timeseries"),
+            ui.output_ui("plot_timeseries_container"),
             ui.markdown(
                 """
                 **(2) Summary table, grouped by country, over time.**
@@ -34,127 +37,185 @@ app_ui = ui.page_fluid(
         )
 )
 
+DATA_URL = "https://raw.githubusercontent.com/drpawelo/data/main/health/OCED_simplified.csv"
+COLUMNS_URL = "https://raw.githubusercontent.com/simonpcastillo/dshsc_term3_python/refs/heads/main/data/columns_dataset.csv"
+#how often the session checks on the downloads while they run
+LOAD_POLL_SECS = 0.25
+
 def server(input, output, session):
-    global deaths_df
-    global columns_dataset_df
-    
     deaths_df = reactive.value(pd.DataFrame({}))
     columns_dataset_df = reactive.value(pd.DataFrame({}))
+    #countries and (first, last) year seen so far, before deaths_df is set
+    countries_so_far = reactive.value(())
+    years_so_far = reactive.value(None)
 
-    #read datasets: compiled from healthcare utilisation
-    async def parsed_data_from_url():
-        global deaths_df
-        file_url = "https://raw.githubusercontent.com/drpawelo/data/main/health/OCED_simplified.csv"
-        response = await pyodide.http.pyfetch(file_url) 
-        data = await response.string() 
-        loaded_df = pd.read_csv(StringIO(data)) 
-        return loaded_df
-    
-    #read datasets: variables and dataset
-    async def parsed_data_from_url_2():
-        # done for you - get online data
-        global columns_dataset_df
-        file_url = "https://raw.githubusercontent.com/simonpcastillo/dshsc_term3_python/refs/heads/main/data/columns_dataset.csv"
-        response = await pyodide.http.pyfetch(file_url) 
-        data = await response.string() 
-        columns_dataset_df = pd.read_csv(StringIO(data))
-        return columns_dataset_df
-
-    #load data    
+    #read a csv file, parsing it as it downloads. The parser keeps the
+    #columns, countries and years seen so far
+    async def parsed_data_from_url(file_url, parser):
+        status, headers, chunks = await fetch_chunks(file_url)
+        if status != 200:
+            raise RuntimeError("could not fetch " + file_url + " (" + str(status) + ")")
+        async for data in chunks:
+            await run_blocking(parser.feed, data)
+        return await run_blocking(parser.finish)
+
+    #datasets: compiled from healthcare utilisation, and the variables of each
+    #dataset. Both downloads run at the same time
+    data_parser = StreamingCsvParser()
+    loads = {}
+
+    #load data. The downloads run in the background; follow_loading() passes
+    #on whatever is ready, so the selectors work before the whole file is in
     @reactive.Effect 
-    async def refreshData():
-        global deaths_df
-        global columns_dataset_df
-        columns_dataset_df
-        data_so_far = deaths_df.get()
+    def refreshData():
+        with reactive.isolate():
+            data_so_far = deaths_df.get()
         if data_so_far.empty == True:
             print("started loading online data")
-            deaths_df.set(await parsed_data_from_url())
-            columns_dataset_df.set(await parsed_data_from_url_2())
-            print("finished loading online data")
+            loads["data"] = asyncio.ensure_future(parsed_data_from_url(DATA_URL, data_parser))
+            loads["columns"] = asyncio.ensure_future(parsed_data_from_url(COLUMNS_URL, StreamingCsvParser()))
+            prefetch(PLOT_MODULES)
         else:
             print("online data was already loaded")
 
+    def loaded(name):
+        task = loads[name]
+        if not task.done():
+            return None
+        if task.exception() is not None:
+            print("could not load online data:", task.exception())
+            return None
+        return task.result()
+
+    @reactive.effect
+    def follow_loading():
+        if not loads or not all(task.done() for task in loads.values()):
+            reactive.invalidate_later(LOAD_POLL_SECS)
+        if not loads:
+            return
+        with reactive.isolate():
+            columns_loaded = loaded("columns")
+            if columns_loaded is not None and columns_dataset_df.get().empty:
+                columns_dataset_df.set(columns_loaded)
+            loaded_df = loaded("data")
+            if loaded_df is not None and deaths_df.get().empty:
+                deaths_df.set(loaded_df)
+                print("finished loading online data")
+            #only set when changed: an equal tuple would still invalidate
+            if len(data_parser.countries) != len(countries_so_far.get()):
+                countries_so_far.set(tuple(sorted(data_parser.countries)))
+            if data_parser.min_year is not None:
+                years = (int(data_parser.min_year), int(data_parser.max_year))
+                if years != years_so_far.get():
+                    years_so_far.set(years)
+
     #render UI
 
-    #countries selection
+    #countries selection. Rendered once; the choices are added as they arrive
     @output
     @render.ui
     def Countries_from_data():
-        global deaths_df
-        loaded_df = deaths_df.get()
+        return ui.input_selectize("selected_countries", "Select country(ies):", [], multiple=True)
 
-        # get unique countries
-        unique_countries = sorted(list(set(loaded_df['country'])))
-        country_dict = dict(zip(unique_countries, unique_countries))
-    
-        return ui.input_selectize("selected_countries", "Select country(ies):", country_dict, multiple=True)
+    @reactive.effect
+    def update_country_choices():
+        unique_countries = list(countries_so_far.get())
+        with reactive.isolate():
+            selected = input.selected_countries() if "selected_countries" in input else None
+        ui.update_selectize(
+            "selected_countries",
+            choices=dict(zip(unique_countries, unique_countries)),
+            selected=[country for country in selected or () if country in unique_countries]
+        )
     
     #datasets selection. this helps to narrow down the type of variables
     @output
     @render.ui
     def datasets_from_data():
-        global columns_dataset_df
-        columns_dataset_df = columns_dataset_df
-        list_columns = list(columns_dataset_df['health_dataset'])
+        loaded_columns_df = columns_dataset_df.get()
+        if loaded_columns_df.empty:
+            return None
+        list_columns = list(loaded_columns_df['health_dataset'].unique())
         list_columns_dict = dict(zip(list_columns,list_columns))
         return ui.input_selectize("datasets_included", "Select dataset:", list_columns_dict)
 
     #variable selection
     @output
     @render.ui
-    async def variables_filtered_dataset():
-        global columns_dataset_df
-        columns_dataset_df = columns_dataset_df
-        list_variables = list(columns_dataset_df[columns_dataset_df['health_dataset'].isin([input.datasets_included()])]['column'])
+    def variables_filtered_dataset():
+        loaded_columns_df = columns_dataset_df.get()
+        if loaded_columns_df.empty or "datasets_included" not in input:
+            return None
+        list_variables = list(loaded_columns_df[loaded_columns_df['health_dataset'].isin([input.datasets_included()])]['column'])
         list_variables_dict = dict(zip(list_variables,list_variables))
         return ui.input_select("variable_to_plot", "Select variable:", list_variables_dict)
         
-    #select max year. range of years come from data
+    #select max year. range of years come from data, as far as it is loaded
     @output
     @render.ui
     def slider_years_values_from_data():
-        global deaths_df
-        loaded_df = deaths_df.get()
-        minimum_year = min(loaded_df.year.unique())
-        maximum_year = max(loaded_df.year.unique())
-        return ui.input_slider("slider_years_2", "Year", minimum_year, maximum_year, maximum_year)
+        years = years_so_far.get()
+        if years == None:
+            return None
+        minimum_year, maximum_year = years
+        with reactive.isolate():
+            selected_year = input.slider_years_2() if "slider_years_2" in input else maximum_year
+        selected_year = min(max(selected_year, minimum_year), maximum_year)
+        return ui.input_slider("slider_years_2", "Year", minimum_year, maximum_year, selected_year)
 
     #main plot. lines and points. Filtered by user selection on side panel. 
+    #the widget output is added once the plotting stack is imported
     @output
-    @render_widget 
-    async def plot_timeseries():
-        global deaths_df
-        loaded_df = deaths_df.get()
-        selected_year = input.slider_years_2()
-        selected_countries = input.selected_countries()
-        var_plot = input.variable_to_plot()
-        filtered_df = loaded_df[(loaded_df['country'].isin(selected_countries)) & (loaded_df['year'] <=
- selected_year)]
-
-        fig = px.line(filtered_df, 
-                        x = "year", 
-                        y = var_plot, 
-                        color = 'country',
-                        markers = True).update_traces(
-            textposition="bottom right").update_layout(
-            plot_bgcolor='white',
-            xaxis=dict(
-                gridcolor='lightgray'
-            ),
-            yaxis=dict(
-                gridcolor='lightgray'
+    @render.ui
+    def plot_timeseries_container():
+        prefetch(PLOT_MODULES)
+        error = import_error(PLOT_MODULES)
+        if error is not None:
+            return ui.markdown("*The plot could not be loaded: " + str(error) + "*")
+        if not ready(PLOT_MODULES):
+            reactive.invalidate_later(LOAD_POLL_SECS)
+            return ui.markdown("*Loading the plot.*")
+        shinywidgets = profiled_import("shinywidgets")
+        px = profiled_import("plotly.express")
+
+        @output
+        @shinywidgets.render_widget 
+        async def plot_timeseries():
+            loaded_df = deaths_df.get()
+            if loaded_df.empty:
+                return None
+            selected_year = input.slider_years_2()
+            selected_countries = input.selected_countries()
+            var_plot = input.variable_to_plot()
+            filtered_df = loaded_df[(loaded_df['country'].isin(selected_countries)) & (loaded_df['year'] <=
+     selected_year)]
+
+            fig = px.line(filtered_df, 
+                            x = "year", 
+                            y = var_plot, 
+                            color = 'country',
+                            markers = True).update_traces(
+                textposition="bottom right").update_layout(
+                plot_bgcolor='white',
+                xaxis=dict(
+                    gridcolor='lightgray'
+                ),
+                yaxis=dict(
+                    gridcolor='lightgray'
+                )
             )
-        )
-        return fig
+            return fig
+
+        return shinywidgets.output_widget("plot_timeseries")
 
     
     #table output. averaged along the time window grouping by country
     @output
     @render.table
     def table_all_data_with_year_from_slider():
-        global deaths_df
         loaded_df = deaths_df.get()
+        if loaded_df.empty:
+            return None
         selected_year = input.slider_years_2()
         selected_countries = input.selected_countries()
         var_plot = input.variable_to_plot()
@@ -0,0 +1,220 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import time
+
+import pandas as pd
+from shiny import reactive
+from shiny.types import SilentException
+
+logger = logging.getLogger("dashboard.diagnostics")
+# JSON lines file for the structured log; otherwise configure the logger
+LOG_PATH = os.environ.get("DASHBOARD_DIAGNOSTICS_LOG")
+if LOG_PATH:
+    _handler = logging.FileHandler(LOG_PATH)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# share of runs written to the structured log and sized in bytes. Counters
+# and timings are always kept; they cost two clock reads and a dict update
+SAMPLE_RATE = float(os.environ.get("DASHBOARD_DIAGNOSTICS_SAMPLE_RATE", 0.1))
+# show the diagnostics panel in the app
+PANEL_ENABLED = os.environ.get("DASHBOARD_DIAGNOSTICS", "") not in ("", "0")
+
+# durations kept per output/effect for the percentiles
+WINDOW = 256
+
+
+class _Stats:
+    def __init__(self, kind):
+        self.kind = kind
+        self.runs = 0
+        self.errors = 0
+        self.total_secs = 0.0
+        self.last_secs = 0.0
+        self.max_secs = 0.0
+        self.durations = []
+        self.bytes_sampled = 0
+        self.bytes_last = None
+        self.last_trigger = {}
+
+    def add(self, secs):
+        self.runs += 1
+        self.total_secs += secs
+        self.last_secs = secs
+        self.max_secs = max(self.max_secs, secs)
+        self.durations.append(secs)
+        if len(self.durations) > WINDOW:
+            del self.durations[: len(self.durations) - WINDOW]
+
+
+#per-session timing of outputs and effects. Wrap outputs with output() and
+#effect functions with effect():
+#
+#    @diagnostics.output
+#    @render.ui
+#    def my_output(): ...
+#
+#    @reactive.effect
+#    @diagnostics.effect
+#    def my_effect(): ...
+#
+#every run records its wall time and which of the watched inputs changed
+#since the previous run; sampled runs also record the bytes of the rendered
+#value and are logged as one JSON line to the "dashboard.diagnostics" logger
+class Diagnostics:
+    def __init__(self, session, watch_inputs=(), sample_rate=None):
+        self.session = session
+        self.watch_inputs = tuple(watch_inputs)
+        self.sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+        self.stats = {}
+        self._last_inputs = {}
+        self._sent = {}
+
+    def _input_values(self):
+        values = {}
+        with reactive.isolate():
+            for name in self.watch_inputs:
+                try:
+                    value = self.session.input[name]()
+                except Exception:
+                    continue
+                values[name] = list(value) if isinstance(value, tuple) else value
+        return values
+
+    def _trigger(self, name):
+        values = self._input_values()
+        previous = self._last_inputs.get(name, {})
+        self._last_inputs[name] = values
+        return {key: value for key, value in values.items() if previous.get(key, None) != value}
+
+    #bytes an effect sent to the client by other means than an output value,
+    #e.g. widget patches. Call it during the run; it is recorded with the run
+    def sent(self, name, nbytes):
+        self._sent[name] = self._sent.get(name, 0) + nbytes
+
+    def _record(self, name, kind, secs, trigger, failed, value=None, sized=False):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = _Stats(kind)
+        stats.add(secs)
+        stats.last_trigger = trigger
+        if failed:
+            stats.errors += 1
+        #reported by the effect itself, so known for every run
+        sent = self._sent.pop(name, None)
+        if sent is not None:
+            stats.bytes_last = sent
+            stats.bytes_sampled += sent
+        if random.random() >= self.sample_rate:
+            return
+        #sizes and records only feed the panel and the log: skipped when
+        #neither would show them
+        log_enabled = logger.isEnabledFor(logging.INFO)
+        if not (log_enabled or PANEL_ENABLED):
+            return
+        record = {
+            "session": getattr(self.session, "id", None),
+            "name": name,
+            "kind": kind,
+            "ms": round(secs * 1000, 3),
+            "run": stats.runs,
+            "trigger": trigger,
+            "error": failed,
+        }
+        if sized:
+            try:
+                nbytes = len(json.dumps(value, default=str))
+            except (TypeError, ValueError):
+                nbytes = None
+            stats.bytes_last = nbytes
+            stats.bytes_sampled += nbytes or 0
+            record["bytes"] = nbytes
+        elif sent is not None:
+            record["bytes"] = sent
+        if log_enabled:
+            logger.info(json.dumps(record, default=str))
+
+    #time a renderer's render(): the user function plus the conversion of its
+    #result to what is sent to the client, which is what gets sized
+    def output(self, renderer):
+        name = renderer.output_id
+        render = renderer.render
+
+        async def timed_render():
+            trigger = self._trigger(name)
+            start = time.perf_counter()
+            value = None
+            failed = False
+            try:
+                value = await render()
+                return value
+            except SilentException:
+                raise
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                self._record(name, "output", time.perf_counter() - start, trigger, failed, value, sized=True)
+
+        renderer.render = timed_render
+        return renderer
+
+    def effect(self, fn):
+        name = fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed_effect():
+                trigger = self._trigger(name)
+                start = time.perf_counter()
+                failed = False
+                try:
+                    return await fn()
+                except SilentException:
+                    raise
+                except BaseException:
+                    failed = True
+                    raise
+                finally:
+                    self._record(name, "effect", time.perf_counter() - start, trigger, failed)
+        else:
+            @functools.wraps(fn)
+            def timed_effect():
+                trigger = self._trigger(name)
+                start = time.perf_counter()
+                failed = False
+                try:
+                    return fn()
+                except SilentException:
+                    raise
+                except BaseException:
+                    failed = True
+                    raise
+                finally:
+                    self._record(name, "effect", time.perf_counter() - start, trigger, failed)
+
+        return timed_effect
+
+    #one row per output/effect, for the diagnostics panel
+    def table(self):
+        rows = []
+        for name, stats in self.stats.items():
+            durations = pd.Series(stats.durations, dtype=float) * 1000
+            rows.append({
+                "name": name,
+                "kind": stats.kind,
+                "runs": stats.runs,
+                "errors": stats.errors,
+                "last ms": stats.last_secs * 1000,
+                "p50 ms": durations.quantile(0.5),
+                "p90 ms": durations.quantile(0.9),
+                "max ms": stats.max_secs * 1000,
+                "last bytes": stats.bytes_last,
+                "last trigger": ", ".join(stats.last_trigger),
+            })
+        return pd.DataFrame(rows)
@@ -0,0 +1,175 @@
+"""Deferred imports for a faster cold start.
+
+The plotting stack (shinywidgets, plotly) is the slowest part of importing
+the app and is only needed once a plot is shown. With DASHBOARD_DEFER_IMPORTS
+on (the default) it is imported in the background, alongside the data fetch,
+and the plot outputs wait for it. Every import made through this module is
+timed and sized.
+
+Startup profile of an app module or file, per top-level import:
+
+    python lazy_imports.py app
+    python lazy_imports.py "from shiny import App, render, ui, react.py"
+"""
+import asyncio
+import functools
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import pyodide  # noqa: F401
+    _threads = False
+except ImportError:
+    _threads = True
+
+# import the plotting stack after the UI is up rather than with the app
+DEFER_IMPORTS = os.environ.get("DASHBOARD_DEFER_IMPORTS", "1") not in ("", "0")
+# print every deferred import as it finishes
+PROFILE_IMPORTS = os.environ.get("DASHBOARD_IMPORT_PROFILE", "") not in ("", "0")
+
+# module name -> (seconds, bytes of the modules it loaded, number of modules)
+import_profile = {}
+# module (or warm up) name -> the exception a background import raised
+import_errors = {}
+_lock = threading.RLock()
+_prefetching = set()
+
+
+def _module_bytes(names):
+    total = 0
+    for name in names:
+        path = getattr(sys.modules.get(name), "__file__", None)
+        if path and os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+#import a module, recording its time and the size of what it loaded
+def profiled_import(name):
+    with _lock:
+        if name in import_profile:
+            return sys.modules[name]
+        before = set(sys.modules)
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        secs = time.perf_counter() - start
+        loaded = set(sys.modules) - before
+        import_profile[name] = (secs, _module_bytes(loaded), len(loaded))
+    if PROFILE_IMPORTS:
+        print("imported", name, "in", round(secs * 1000), "ms,", import_profile[name][1], "bytes,", len(loaded), "modules")
+    return module
+
+
+#whether every module was imported through profiled_import()
+def ready(names):
+    return all(name in import_profile for name in names)
+
+
+#the first error a background import of the modules raised, or None
+def import_error(names):
+    for name in names:
+        if name in import_errors:
+            return import_errors[name]
+    return None
+
+
+#run one prefetch step; a failure is recorded instead of being lost on the
+#thread, and the module is no longer counted as on its way
+def _prefetch_step(name, step):
+    try:
+        step()
+    except Exception as e:
+        import_errors[name] = e
+        print("background import of", name, "failed:", repr(e))
+    finally:
+        _prefetching.discard(name)
+
+
+#start importing the modules in the background: on a thread, or under pyodide
+#(no threads) one module per event loop turn, between the fetch's awaits.
+#warm_up, if given, is called once they are imported. Modules that failed
+#are not retried
+def prefetch(names, warm_up=None):
+    names = [
+        name for name in names
+        if name not in import_profile and name not in _prefetching and name not in import_errors
+    ]
+    if not names:
+        return
+    _prefetching.update(names)
+    steps = [functools.partial(_prefetch_step, name, functools.partial(profiled_import, name)) for name in names]
+    if warm_up is not None:
+        def warm_up_step():
+            if import_error(names) is None:
+                _prefetch_step(warm_up.__name__, warm_up)
+        steps.append(warm_up_step)
+    if _threads:
+        thread = threading.Thread(target=lambda: [step() for step in steps], daemon=True)
+        thread.start()
+    else:
+        loop = asyncio.get_event_loop()
+        for step in steps:
+            loop.call_soon(step)
+
+
+#time (ms, cumulative) and bytes of each top-level import of a module (or of
+#a .py file), from a fresh interpreter run with -X importtime
+def startup_profile(module):
+    if module.endswith(".py"):
+        load, top = "import runpy; runpy.run_path(" + repr(module) + ")", 0
+    else:
+        load, top = "import " + module, 1
+    code = (
+        "import json, sys\n"
+        "sys.stderr.write('-- start\\n'); sys.stderr.flush()\n"
+        + load + "\n"
+        "print(json.dumps({name: getattr(m, '__file__', None) for name, m in list(sys.modules.items())}))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True
+    )
+    files = json.loads(result.stdout.strip().splitlines()[-1])
+
+    lines = result.stderr.splitlines()
+    rows = []
+    subtree = []
+    for line in lines[lines.index("-- start") + 1:]:
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[12:].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth < top:
+            break
+        subtree.append(name)
+        if depth == top:
+            size = sum(
+                os.path.getsize(files[loaded]) for loaded in subtree
+                if files.get(loaded) and os.path.isfile(files[loaded])
+            )
+            rows.append((name, int(cumulative) / 1000, size, len(subtree)))
+            subtree = []
+    return rows
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "app"
+    rows = startup_profile(module)
+    print("startup imports of", module, "(DASHBOARD_DEFER_IMPORTS=" + ("1" if DEFER_IMPORTS else "0") + ")")
+    for name, ms, size, n_modules in sorted(rows, key=lambda row: -row[1]):
+        print("  {0:<32} {1:9.1f} ms {2:12d} bytes {3:5d} modules".format(name, ms, size, n_modules))
+    print("  {0:<32} {1:9.1f} ms {2:12d} bytes".format(
+        "total", sum(row[1] for row in rows), sum(row[2] for row in rows)
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# colours of the plotted countries, in order: plotly's default qualitative
+# palette (plotly.colors.qualitative.Plotly), kept here without plotly so the
+# report export can use it too
+COLORS = [
+    "#636EFA",
+    "#EF553B",
+    "#00CC96",
+    "#AB63FA",
+    "#FFA15A",
+    "#19D3F3",
+    "#FF6692",
+    "#B6E880",
+    "#FF97FF",
+    "#FECB52",
+]
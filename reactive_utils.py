@@ -0,0 +1,57 @@
+import time
+
+from shiny import reactive
+
+
+#debounce a reactive expression: dependents only see a new value once its
+#inputs have been still for delay_secs, so dragging a slider or typing in a
+#selectize triggers one recomputation instead of one per intermediate value.
+#must be used inside the server function (it creates session effects). With
+#diagnostics, its two effects are timed as <name>_primer and <name>_timer
+def debounce(delay_secs, diagnostics=None):
+    def timed(fn, name):
+        if diagnostics is None:
+            return fn
+        fn.__name__ = name
+        return diagnostics.effect(fn)
+
+    def wrapper(f):
+        when = reactive.value(None)
+        trigger = reactive.value(0)
+
+        @reactive.calc
+        def cached():
+            return f()
+
+        #(re)start the timer whenever the inputs of f change
+        def primer():
+            try:
+                cached()
+            except Exception:
+                pass
+            finally:
+                when.set(time.time() + delay_secs)
+
+        def timer():
+            deadline = when()
+            if deadline is None:
+                return
+            time_left = deadline - time.time()
+            if time_left <= 0:
+                with reactive.isolate():
+                    when.set(None)
+                    trigger.set(trigger() + 1)
+            else:
+                reactive.invalidate_later(time_left)
+
+        reactive.effect(priority=102)(timed(primer, f.__name__ + "_primer"))
+        reactive.effect(priority=101)(timed(timer, f.__name__ + "_timer"))
+
+        @reactive.calc
+        @reactive.event(trigger, ignore_none=False)
+        def debounced():
+            return cached()
+
+        return debounced
+
+    return wrapper
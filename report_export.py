@@ -0,0 +1,357 @@
+"""Batch export of the dashboard's chart and summary table.
+
+Renders one page per (variable, country set, year) combination, outside of
+any Shiny session, on a pool of worker processes. Pages are written as they
+are finished, either into a multi-page PDF or into an HTML bundle (one file
+per page plus an index.html). Only a bounded number of rendered pages waits
+to be written at any time.
+
+A PDF is held in memory, images included, until it is saved. Exports of more
+than --pages-per-file pages are therefore split into report.part001.pdf,
+report.part002.pdf, ... with a report.index.html listing them. For large
+overnight runs --format html keeps memory flat and needs no splitting.
+
+    python report_export.py --groups Consultations --countries "Chile,Japan" --out report.pdf
+    python report_export.py --format html --out report_html --year 2010 --year 2020
+"""
+import argparse
+import asyncio
+import base64
+import html
+import importlib
+import itertools
+import os
+import tempfile
+from collections import deque
+from io import BytesIO
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from catalog import variable_catalog
+from data_loader import CACHE_FORMAT, FrameSource, load_dataset, open_columns, write_columns
+from data_store import CountryYearIndex
+from summary_table import render_summary_table
+from palette import COLORS
+
+# matplotlib and reportlab are imported by name: this script sits in the app
+# directory, and shinylive would otherwise ship both to every browser
+matplotlib = importlib.import_module("matplotlib")
+matplotlib.use("Agg")
+Figure = importlib.import_module("matplotlib.figure").Figure
+
+# dataset index of a worker process, built once by _init_worker
+_index = None
+
+
+def _reportlab(name):
+    return importlib.import_module("reportlab." + name)
+
+
+def _init_worker(source):
+    global _index
+    _index = CountryYearIndex(source)
+
+
+#the dashboard's time series chart as a PNG
+def chart_png(filtered_df, variable, width=8, height=3.6, dpi=120):
+    fig = Figure(figsize=(width, height), dpi=dpi)
+    ax = fig.subplots()
+    groups = filtered_df.groupby("country", sort=False, observed=True)
+    for i, (country, group) in enumerate(groups):
+        ax.plot(
+            group["year"].to_numpy(),
+            group[variable].to_numpy(),
+            marker="o",
+            markersize=3,
+            color=COLORS[i % len(COLORS)],
+            label=country
+        )
+    ax.set_facecolor("white")
+    ax.grid(color="lightgray")
+    ax.set_axisbelow(True)
+    ax.set_xlabel("year")
+    if 0 < len(groups) <= 20:
+        ax.legend(title="country", fontsize=7, title_fontsize=8, loc="center left", bbox_to_anchor=(1.0, 0.5))
+    fig.tight_layout()
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+#one page: chart and per-country mean up to the year, as on the dashboard
+def render_page(job):
+    variable, countries, year = job
+    filtered_df = _index.select(countries, year, columns=["country", "year", variable])
+    summarised_df = _index.summary(variable, countries, year)
+    return {
+        "variable": variable,
+        "countries": list(countries),
+        "year": year,
+        "chart_png": chart_png(filtered_df, variable),
+        "summary": summarised_df,
+    }
+
+
+def render_pages(jobs):
+    return [render_page(job) for job in jobs]
+
+
+class HtmlBundleWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.pages = []
+
+    def write(self, page):
+        name = "page_" + str(len(self.pages) + 1).zfill(5) + ".html"
+        title = html.escape(page["variable"])
+        image = base64.b64encode(page["chart_png"]).decode("ascii")
+        table = render_summary_table(page["summary"], page["variable"], True)
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(
+                "<!DOCTYPE html><html><head><meta charset='utf-8'><title>" + title + "</title></head><body>"
+                + "<h2>" + title + "</h2>"
+                + "<p>" + html.escape(", ".join(page["countries"])) + " &mdash; up to " + str(page["year"]) + "</p>"
+                + "<img src='data:image/png;base64," + image + "'>"
+                + table
+                + "<p>Yellow is maximum, grey is minimum.</p></body></html>"
+            )
+        self.pages.append((name, page["variable"], page["year"], len(page["countries"])))
+
+    def close(self):
+        links = "".join(
+            "<li><a href='" + name + "'>" + html.escape(variable) + "</a> (" + str(year)
+            + ", " + str(n_countries) + " countries)</li>"
+            for name, variable, year, n_countries in self.pages
+        )
+        with open(os.path.join(self.path, "index.html"), "w") as f:
+            f.write(
+                "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Report</title></head><body>"
+                + "<h1>Worldwide time series of healthcare utilisation</h1><ul>" + links + "</ul></body></html>"
+            )
+
+
+#multi-page PDF. reportlab keeps the whole document in memory until it is
+#saved, so with pages_per_file the report is split into parts of that many
+#report pages (path.part001.pdf, ...), each saved when full, plus an index
+class PdfReportWriter:
+    ROWS_PER_PAGE = 30
+
+    def __init__(self, path, pages_per_file=None):
+        rl_config = _reportlab("rl_config")
+        A4 = _reportlab("lib.pagesizes").A4
+
+        # images go in as binary streams; reportlab's pure python ASCII85
+        # encoding would otherwise dominate the export time
+        rl_config.useA85 = 0
+        self.page_width, self.page_height = A4
+        self.path = path
+        self.pages_per_file = pages_per_file
+        self.parts = []
+        self.pdf = None
+        self._pages_in_part = 0
+
+    def _part_path(self, number):
+        if not self.pages_per_file:
+            return self.path
+        stem, ext = os.path.splitext(self.path)
+        return stem + ".part" + str(number).zfill(3) + (ext or ".pdf")
+
+    def _next_part(self):
+        A4 = _reportlab("lib.pagesizes").A4
+        canvas = _reportlab("pdfgen.canvas")
+
+        if self.pdf is not None:
+            self.pdf.save()
+        path = self._part_path(len(self.parts) + 1)
+        self.parts.append([path, []])
+        self.pdf = canvas.Canvas(path, pagesize=A4)
+        self._pages_in_part = 0
+
+    def _table(self, rows, styles):
+        colors = _reportlab("lib.colors")
+        platypus = _reportlab("platypus")
+
+        table_style = [
+            ("ALIGN", (0, 0), (-1, -1), "RIGHT"),
+            ("FONTSIZE", (0, 0), (-1, -1), 8),
+            ("LINEBELOW", (0, 0), (-1, 0), 0.5, colors.black),
+        ]
+        for row, color in styles:
+            table_style.append(("BACKGROUND", (1, row), (1, row), getattr(colors, color)))
+        table = platypus.Table(rows)
+        table.setStyle(platypus.TableStyle(table_style))
+        return table
+
+    def write(self, page):
+        utils = _reportlab("lib.utils")
+
+        if self.pdf is None or (self.pages_per_file and self._pages_in_part >= self.pages_per_file):
+            self._next_part()
+        self._pages_in_part += 1
+        self.parts[-1][1].append((page["variable"], page["year"], len(page["countries"])))
+
+        variable = page["variable"]
+        summarised_df = page["summary"]
+        margin = 40
+        top = self.page_height - margin
+        for line in utils.simpleSplit(variable, "Helvetica-Bold", 12, self.page_width - 2 * margin):
+            self.pdf.setFont("Helvetica-Bold", 12)
+            self.pdf.drawString(margin, top, line)
+            top -= 15
+        subtitle = ", ".join(page["countries"]) + " - up to " + str(page["year"])
+        for line in utils.simpleSplit(subtitle, "Helvetica", 9, self.page_width - 2 * margin)[:3]:
+            self.pdf.setFont("Helvetica", 9)
+            self.pdf.drawString(margin, top, line)
+            top -= 12
+
+        image = utils.ImageReader(BytesIO(page["chart_png"]))
+        image_width, image_height = image.getSize()
+        width = self.page_width - 2 * margin
+        height = width * image_height / image_width
+        top -= height + 6
+        self.pdf.drawImage(image, margin, top, width, height)
+
+        values = summarised_df[variable].to_numpy(dtype=float)
+        header = ["country", "mean up to " + str(page["year"])]
+        body = [
+            [country, "" if np.isnan(value) else "{0:0.3f}".format(value)]
+            for country, value in zip(summarised_df["country"], values)
+        ]
+        highlight = []
+        if np.isfinite(values).any():
+            highlight = [
+                (i + 1, "yellow" if value == np.nanmax(values) else "lightgrey")
+                for i, value in enumerate(values)
+                if value == np.nanmax(values) or value == np.nanmin(values)
+            ]
+        for start in range(0, max(len(body), 1), self.ROWS_PER_PAGE):
+            rows = [header] + body[start:start + self.ROWS_PER_PAGE]
+            styles = [
+                (row - start, color) for row, color in highlight
+                if start < row <= start + self.ROWS_PER_PAGE
+            ]
+            table = self._table(rows, styles)
+            _, table_height = table.wrapOn(self.pdf, width, top - margin)
+            if top - table_height - 12 < margin:
+                self.pdf.showPage()
+                top = self.page_height - margin
+            table.drawOn(self.pdf, margin, top - table_height - 12)
+            top -= table_height + 12
+        self.pdf.showPage()
+
+    def close(self):
+        if self.pdf is None:
+            self._next_part()
+        self.pdf.save()
+        if self.pages_per_file:
+            links = "".join(
+                "<li><a href='" + html.escape(os.path.basename(path)) + "'>" + html.escape(os.path.basename(path))
+                + "</a>: " + html.escape(pages[0][0]) + " to " + html.escape(pages[-1][0])
+                + " (" + str(len(pages)) + " pages)</li>"
+                for path, pages in self.parts if pages
+            )
+            stem, _ = os.path.splitext(self.path)
+            with open(stem + ".index.html", "w") as f:
+                f.write(
+                    "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Report</title></head><body>"
+                    + "<h1>Worldwide time series of healthcare utilisation</h1><ul>" + links + "</ul></body></html>"
+                )
+
+
+def build_jobs(variables, country_sets, years):
+    return itertools.product(variables, [tuple(countries) for countries in country_sets], years)
+
+
+#render every job and stream the pages into the writer, in job order. With
+#workers > 1 pages are rendered in parallel, chunksize jobs per task; at most
+#max_pending tasks are submitted ahead of the writer, so a slow writer holds
+#back the workers instead of rendered pages piling up in memory
+#a source worker processes open from disk. A FrameSource would be pickled
+#whole into every worker, so its columns are written to temp_dir first
+def _disk_source(source, temp_dir):
+    if not isinstance(source, FrameSource):
+        return source
+    path = os.path.join(temp_dir, "columns." + CACHE_FORMAT)
+    write_columns(source.df, path)
+    return open_columns(path, source.fingerprint)
+
+
+def export(source, jobs, writer, workers=None, chunksize=4, max_pending=None):
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    written = 0
+    if workers == 1:
+        _init_worker(source)
+        for job in jobs:
+            writer.write(render_page(job))
+            written += 1
+    else:
+        jobs = iter(jobs)
+        with tempfile.TemporaryDirectory(prefix="report_export.") as temp_dir, Pool(
+            workers, initializer=_init_worker, initargs=(_disk_source(source, temp_dir),)
+        ) as pool:
+            pending = deque()
+            while True:
+                while len(pending) < max_pending:
+                    chunk = list(itertools.islice(jobs, chunksize))
+                    if not chunk:
+                        break
+                    pending.append(pool.apply_async(render_pages, (chunk,)))
+                if not pending:
+                    break
+                for page in pending.popleft().get():
+                    writer.write(page)
+                    written += 1
+    writer.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", help="local CSV instead of the (cached) OECD dataset")
+    parser.add_argument("--variables", action="append", default=[], help="variable to export (repeatable)")
+    parser.add_argument("--groups", action="append", default=[], help="export every variable of a dataset group (repeatable)")
+    parser.add_argument("--countries", action="append", default=[], help="comma separated country set (repeatable; default: all countries)")
+    parser.add_argument("--year", action="append", type=int, default=[], help="last year included (repeatable; default: latest)")
+    parser.add_argument("--format", choices=("pdf", "html"), default="pdf")
+    parser.add_argument("--out", default="report.pdf")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--pages-per-file", type=int, default=200, help="split larger PDF reports into parts of this many pages")
+    args = parser.parse_args()
+
+    if args.data:
+        source = FrameSource(pd.read_csv(args.data))
+    else:
+        source = asyncio.run(load_dataset())
+    index = CountryYearIndex(source)
+
+    available = set(index.variables)
+    variables = list(args.variables) + variable_catalog().variables_in(args.groups)
+    if not variables:
+        variables = [variable for variable in variable_catalog().variables if variable in available]
+    missing = [variable for variable in variables if variable not in available]
+    if missing:
+        parser.error("not in the dataset: " + "; ".join(missing))
+    country_sets = [
+        [country.strip() for country in countries.split(",") if country.strip()]
+        for countries in args.countries
+    ] or [index.countries]
+    years = args.year or [int(index.years.max())]
+
+    if args.format == "pdf":
+        n_pages = len(variables) * len(country_sets) * len(years)
+        writer = PdfReportWriter(args.out, args.pages_per_file if n_pages > args.pages_per_file else None)
+    else:
+        writer = HtmlBundleWriter(args.out)
+    written = export(source, build_jobs(variables, country_sets, years), writer, args.workers)
+    if args.format == "pdf" and writer.pages_per_file:
+        print("wrote", written, "pages to", len(writer.parts), "files, listed in", os.path.splitext(args.out)[0] + ".index.html")
+    else:
+        print("wrote", written, "pages to", args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import html
+
+import numpy as np
+
+# rows per page of the summary table in the app
+PAGE_SIZE = 50
+
+# orders of render_summary_table(): by country, or by value, missing values last
+SORT_ORDERS = {
+    "country": "Country",
+    "desc": "Highest first",
+    "asc": "Lowest first",
+}
+
+_STYLE = (
+    '<style type="text/css">\n'
+    "#{id} td {{\n  text-align: right;\n}}\n"
+    "#{id} th {{\n  text-align: right;\n}}\n"
+    "</style>\n"
+)
+_HEADER = (
+    '<table id="{id}"{attributes}>\n'
+    "  <thead>\n"
+    "    <tr>\n"
+    "      <th>country</th>\n"
+    "      <th>{variable}</th>\n"
+    "    </tr>\n"
+    "  </thead>\n"
+    "  <tbody>\n"
+)
+_ROW = "    <tr>\n      <td>{0}</td>\n      <td{1}>{2}</td>\n    </tr>\n"
+_FOOTER = "  </tbody>\n</table>\n"
+_HIGHLIGHT = {
+    0: "",
+    1: ' style="background-color: yellow;"',
+    2: ' style="background-color: lightgray;"',
+}
+
+
+def page_count(n_rows, page_size=PAGE_SIZE):
+    if not page_size:
+        return 1
+    return max(1, -(-n_rows // page_size))
+
+
+#summary table as HTML. Values with 3 decimals, right aligned; with highlight
+#on, the max of the whole table is yellow and the min grey. Rows can be sorted
+#and paged (page counts from 1) so only the visible rows are rendered
+def render_summary_table(summarised_df, var_plot, highlight, sort_by="country",
+                         page=1, page_size=None, table_id="summary-table"):
+    countries = summarised_df["country"].to_numpy(dtype=object)
+    values = summarised_df[var_plot].to_numpy(dtype=float)
+
+    #0 plain, 1 max, 2 min; ties are all highlighted, NaN never is
+    marks = np.zeros(len(values), dtype=np.int8)
+    if highlight and np.isfinite(values).any():
+        marks[values == np.nanmin(values)] = 2
+        marks[values == np.nanmax(values)] = 1
+
+    if sort_by == "desc":
+        order = np.argsort(-values, kind="stable")
+    elif sort_by == "asc":
+        order = np.argsort(values, kind="stable")
+    else:
+        order = np.arange(len(values))
+
+    n_pages = page_count(len(values), page_size)
+    page = min(max(int(page), 1), n_pages)
+    if page_size:
+        order = order[(page - 1) * page_size:page * page_size]
+
+    attributes = ' class="dataframe shiny-table table w-auto"' if highlight else ""
+    parts = [
+        _STYLE.format(id=table_id),
+        _HEADER.format(id=table_id, attributes=attributes, variable=html.escape(str(var_plot))),
+    ]
+    parts.extend(
+        _ROW.format(
+            html.escape(str(countries[i])),
+            _HIGHLIGHT[marks[i]],
+            "{0:0.3f}".format(values[i])
+        )
+        for i in order
+    )
+    parts.append(_FOOTER)
+    if n_pages > 1:
+        first = (page - 1) * page_size + 1
+        parts.append(
+            '<p class="text-muted small">Rows ' + str(first) + "-" + str(first + len(order) - 1)
+            + " of " + str(len(values)) + ", page " + str(page) + " of " + str(n_pages) + "</p>\n"
+        )
+    return "".join(parts)
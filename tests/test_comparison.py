@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from comparison import ComparisonEngine
+from data_store import CountryYearIndex
+
+
+def make_index():
+    return CountryYearIndex(pd.DataFrame({
+        "country": ["A", "B", "C", "D", "A", "B", "C", "D"],
+        "year": [2000, 2000, 2000, 2000, 2001, 2001, 2001, 2001],
+        "v": [3.0, 5.0, 3.0, np.nan, 1.0, 2.0, 4.0, 8.0],
+    }))
+
+
+def test_ties_share_the_best_rank():
+    engine = ComparisonEngine(make_index(), ["v"], ["percentile"])
+    ranking_df = engine.ranking("v", 2000)
+    assert list(ranking_df["country"]) == ["B", "A", "C"]
+    assert list(ranking_df["rank"]) == [1, 2, 2]
+    np.testing.assert_allclose(ranking_df["percentile"], [100, 50, 50])
+
+
+def test_compare_is_a_lookup_of_the_metric():
+    engine = ComparisonEngine(make_index(), ["v"], ["change"])
+    compared_df = engine.compare(["D", "A"], 2001, "change")
+    assert list(compared_df.columns) == ["D", "A"]
+    assert np.isnan(compared_df.loc["v", "D"])
+    assert compared_df.loc["v", "A"] == -2.0
+    assert engine.values.dtype == np.float32
@@ -0,0 +1,39 @@
+import io
+
+import pandas as pd
+
+from data_loader import StreamingCsvParser, content_hash
+
+
+CSV_TEXT = "country,year,a,note\n" + "".join(
+    "Country " + str(i % 7) + "," + str(1990 + i % 30) + "," + str(i * 0.1) + "," + ("x" if i % 3 else "") + "\n"
+    for i in range(3000)
+)
+
+
+def feed(text, chunk_size):
+    parser = StreamingCsvParser()
+    data = text.encode("utf-8")
+    for start in range(0, len(data), chunk_size):
+        parser.feed(data[start:start + chunk_size])
+    return parser
+
+
+def test_finish_matches_read_csv():
+    for chunk_size in (7, 1000, 10**6):
+        parser = feed(CSV_TEXT, chunk_size)
+        pd.testing.assert_frame_equal(parser.finish(), pd.read_csv(io.StringIO(CSV_TEXT)))
+
+
+def test_progress_and_hash():
+    parser = feed(CSV_TEXT.rstrip("\n"), 500)
+    assert parser.sha256 == content_hash(CSV_TEXT.rstrip("\n"))
+    assert parser.columns == ["country", "year", "a", "note"]
+    parser.finish()
+    assert parser.rows == 3000
+    assert sorted(parser.countries) == ["Country " + str(i) for i in range(7)]
+    assert (parser.min_year, parser.max_year) == (1990, 2019)
+
+
+def test_empty_body():
+    assert StreamingCsvParser().finish().empty
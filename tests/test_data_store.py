@@ -0,0 +1,88 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from data_store import (
+    BoundedCache,
+    CountryYearIndex,
+    DatasetStore,
+    Snapshot,
+    SnapshotDiff,
+    compact_values,
+    diff_indexes,
+    widen_values,
+)
+
+
+def make_df():
+    return pd.DataFrame({
+        "country": ["Chile", "Japan", "Chile", "Japan", "Chile", "Peru"],
+        "year": [2001, 2000, 2000, 2001, 2002, 2000],
+        "a": [1.5, 2.0, np.nan, 4.0, 3.25, 7.0],
+        "b": [10.0, 20.0, 30.0, np.nan, 50.0, 60.0],
+    })
+
+
+def test_summary_matches_groupby_mean():
+    df = make_df()
+    index = CountryYearIndex(df)
+    for year in (1999, 2000, 2001, 2002):
+        summary_df = index.summary("a", ["Peru", "Chile", "Japan"], year)
+        expected = df[df["year"] <= year].groupby("country")["a"].mean()
+        assert list(summary_df["country"]) == list(expected.index)
+        np.testing.assert_allclose(summary_df["a"].to_numpy(), expected.to_numpy(), equal_nan=True)
+
+
+def test_diff_indexes_changed_added_and_removed_rows():
+    old_df = make_df()
+    new_df = old_df.drop(index=5)
+    new_df.loc[0, "b"] = 11.0
+    new_df = pd.concat([new_df, pd.DataFrame({"country": ["Japan"], "year": [2002], "a": [5.0], "b": [1.0]})])
+    diff = diff_indexes(CountryYearIndex(old_df), CountryYearIndex(new_df))
+    assert (diff.added_rows, diff.removed_rows, diff.changed_cells) == (1, 1, 1)
+    assert diff.row_countries == {"Japan", "Peru"}
+    assert diff.changed == {"b": {"Chile"}}
+    assert not diff.affects(["a"], ["Chile"])
+    assert diff.affects(["b"], ["Chile"])
+    assert diff.affects(["a"], ["Peru"])
+
+
+def test_diff_indexes_with_duplicate_keys_is_unknown():
+    df = make_df()
+    duplicated_df = pd.concat([df, df.iloc[[0]]])
+    assert diff_indexes(CountryYearIndex(df), CountryYearIndex(duplicated_df)) is None
+    assert diff_indexes(CountryYearIndex(duplicated_df), CountryYearIndex(df)) is None
+
+
+def test_publish_keeps_only_unaffected_results():
+    store = DatasetStore()
+    snapshot = store.swap(make_df())
+    version = snapshot.version
+    store.cached(("summary", version, "a"), lambda: "a everywhere", variables=["a"])
+    store.cached(("summary", version, "b", "Japan"), lambda: "b in Japan", variables=["b"], countries=["Japan"])
+    store.cached(("summary", version, "b", "Chile"), lambda: "b in Chile", variables=["b"], countries=["Chile"])
+    store._publish(Snapshot(make_df()), SnapshotDiff(changed={"b": {"Chile"}}))
+    new_version = store.version
+    assert new_version == version + 1
+    assert sorted(key for key, value, nbytes in store.results.items()) == [
+        ("summary", new_version, "a"),
+        ("summary", new_version, "b", "Japan"),
+    ]
+
+
+def test_bounded_cache_rekey_drops_keys_mapped_to_none():
+    cache = BoundedCache(8)
+    for key in ("x", "y", "z"):
+        cache.put(key, key * 4)
+    cache.rekey(lambda key: None if key == "y" else key + "2")
+    assert [key for key, value, nbytes in cache.items()] == ["x2", "z2"]
+    assert cache.bytes == 8
+
+
+def test_compact_values_round_trips_decimal_data():
+    values = pd.read_csv(io.StringIO("v\n0.1\n123456.7\n3.25\n\n")).v.to_numpy()
+    compact = compact_values(values)
+    assert compact.dtype == np.float32
+    np.testing.assert_array_equal(widen_values(compact), values)
+    assert compact_values(np.array([0.123456789])).dtype == np.float64
@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+
+from palette import COLORS
+
+# above this many points the traces switch to WebGL (go.Scattergl)
+WEBGL_POINT_THRESHOLD = int(os.environ.get("WEBGL_POINT_THRESHOLD", 5000))
+
+
+#empty figure with the dashboard's look. It is created once per session and
+#then patched in place by update_timeseries_figure()
+def new_timeseries_figure():
+    return go.FigureWidget(
+        layout=dict(
+            plot_bgcolor='white',
+            xaxis=dict(
+                title=dict(text="year"),
+                gridcolor='lightgray'
+            ),
+            yaxis=dict(
+                gridcolor='lightgray'
+            ),
+            legend=dict(title=dict(text="country"))
+        )
+    )
+
+
+#plotly imports its validators and loads the default template on the first
+#figure; doing it ahead (a plain Figure, no session needed) takes that off the
+#first render of the plot
+def warm_up():
+    go.Figure(layout=dict(plot_bgcolor='white'), data=[go.Scatter(), go.Scattergl()])
+
+
+def _hovertemplate(country, var_plot):
+    return "country=" + str(country) + "<br>year=%{x}<br>" + var_plot + "=%{y}<extra></extra>"
+
+
+def _free_color(fig):
+    used = {trace.line.color for trace in fig.data}
+    for color in COLORS:
+        if color not in used:
+            return color
+    return COLORS[len(fig.data) % len(COLORS)]
+
+
+#patch the figure to show filtered_df (country, year, var_plot rows, sorted by
+#year within each country). Only traces of added or removed countries are
+#created or dropped; the others just get their x/y arrays replaced, and only
+#if they changed. numpy arrays go to the client as binary typed arrays.
+#Returns the bytes of the arrays and strings assigned: what the patch sends
+def update_timeseries_figure(fig, filtered_df, var_plot, webgl_threshold=None):
+    if webgl_threshold is None:
+        webgl_threshold = WEBGL_POINT_THRESHOLD
+    if filtered_df is None or var_plot is None:
+        fig.data = ()
+        return 0
+
+    trace_class = go.Scattergl if len(filtered_df) > webgl_threshold else go.Scatter
+    trace_type = "scattergl" if trace_class is go.Scattergl else "scatter"
+    series = {
+        country: (group["year"].to_numpy(), group[var_plot].to_numpy())
+        for country, group in filtered_df.groupby("country", sort=False, observed=True)
+    }
+
+    #drop deselected countries, and every trace when switching to/from WebGL
+    kept = tuple(
+        trace for trace in fig.data
+        if trace.name in series and trace.type == trace_type
+    )
+    if len(kept) != len(fig.data):
+        fig.data = kept
+
+    existing = {trace.name: trace for trace in fig.data}
+    nbytes = 0
+    with fig.batch_update():
+        for country, (x, y) in series.items():
+            trace = existing.get(country)
+            if trace is None:
+                continue
+            if len(trace.x) != len(x) or not np.array_equal(trace.x, x):
+                trace.x = x
+                nbytes += x.nbytes
+            if len(trace.y) != len(y) or not np.array_equal(trace.y, y, equal_nan=True):
+                trace.y = y
+                nbytes += y.nbytes
+            hovertemplate = _hovertemplate(country, var_plot)
+            if trace.hovertemplate != hovertemplate:
+                trace.hovertemplate = hovertemplate
+                nbytes += len(hovertemplate)
+        fig.layout.yaxis.title.text = var_plot
+
+    for country, (x, y) in series.items():
+        if country not in existing:
+            color = _free_color(fig)
+            fig.add_trace(trace_class(
+                x=x,
+                y=y,
+                name=country,
+                legendgroup=country,
+                mode="lines+markers",
+                line=dict(color=color),
+                marker=dict(color=color),
+                hovertemplate=_hovertemplate(country, var_plot),
+            ))
+            nbytes += x.nbytes + y.nbytes + len(_hovertemplate(country, var_plot))
+    return nbytes